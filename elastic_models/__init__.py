@@ -0,0 +1 @@
+default_app_config = 'elastic_models.apps.ElasticModelsConfig'
@@ -0,0 +1,363 @@
+"""
+asyncio counterparts of searching and indexing, for ASGI deployments.
+
+Requests are sent with aiohttp, through a pooled session for each
+connection in ELASTICSEARCH_CONNECTIONS and event loop.  They use the
+connection's HOSTS and OPTIONS, like the synchronous client, and any
+ASYNC_OPTIONS override them.  This module requires Python 3.5 and aiohttp,
+and is only imported when used.
+"""
+from __future__ import absolute_import
+
+import asyncio
+import itertools
+import json
+import logging
+import ssl
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+import django
+from django.conf import settings
+
+from elasticsearch import TransportError, exceptions
+from elasticsearch.helpers import BulkIndexError, expand_action
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch_dsl.result import Response
+
+from .connections import get_connection_options
+from .fingerprints import record_fingerprints
+from .resultcache import (CachedSearch, get_cached_indexes, get_result_cache,
+                          invalidate_results)
+from .utils import close_db_connections
+from .views import SearchListView
+
+logger = logging.getLogger(__name__)
+
+# Maps each event loop to the transports used in it, by connection name.
+_transports = weakref.WeakKeyDictionary()
+
+
+def get_host_options(host, options):
+    """
+    Returns the options for a host given as in HOSTS (a URL or a dictionary),
+    which override the connection's options, as in elasticsearch-py.
+    """
+    options = dict(options)
+    if isinstance(host, dict):
+        options.update(host)
+        return options
+
+    if '://' not in host:
+        host = "//%s" % host
+    url = urlparse(host)
+    if url.scheme == 'https':
+        options['use_ssl'] = True
+        options.setdefault('port', 443)
+    options['host'] = url.hostname
+    if url.port:
+        options['port'] = url.port
+    if url.username or url.password:
+        options['http_auth'] = "%s:%s" % (unquote(url.username or ''),
+                                          unquote(url.password or ''))
+    if url.path and url.path != '/':
+        options['url_prefix'] = url.path
+    return options
+
+def get_host_url(options):
+    scheme = 'https' if options.get('use_ssl') else 'http'
+    prefix = options.get('url_prefix', '').strip('/')
+    return "%s://%s:%s%s" % (scheme, options.get('host', 'localhost'),
+                             options.get('port', 9200), "/" + prefix if prefix else "")
+
+def get_auth(http_auth):
+    if http_auth is None:
+        return None
+    if isinstance(http_auth, (list, tuple)):
+        return aiohttp.BasicAuth(*http_auth)
+    return aiohttp.BasicAuth(*http_auth.split(':', 1))
+
+def get_ssl_context(options):
+    if not options.get('use_ssl'):
+        return None
+    context = options.get('ssl_context')
+    if context is None:
+        context = ssl.create_default_context(cafile=options.get('ca_certs'))
+        if options.get('verify_certs') is False:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if options.get('client_cert'):
+            context.load_cert_chain(options['client_cert'], options.get('client_key'))
+    return context
+
+
+class AsyncTransport(object):
+    """
+    Sends requests to the hosts of a connection in turn, over an aiohttp
+    session holding at most maxsize connections.  Failed connections (and
+    with retry_on_timeout, timeouts) are retried on the next host, at most
+    max_retries times.  Other options, like http_auth, url_prefix, use_ssl,
+    verify_certs or ca_certs, are as for elasticsearch-py's connections.
+    """
+    def __init__(self, hosts, maxsize=10, timeout=10, max_retries=3,
+                 retry_on_timeout=False, **options):
+        self.hosts = []
+        for host in hosts:
+            host_options = get_host_options(host, options)
+            self.hosts.append((get_host_url(host_options),
+                               get_auth(host_options.get('http_auth')),
+                               get_ssl_context(host_options)))
+        self.next_host = itertools.cycle(self.hosts)
+        self.max_retries = max_retries
+        self.retry_on_timeout = retry_on_timeout
+        self.serializer = JSONSerializer()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=maxsize),
+            timeout=aiohttp.ClientTimeout(total=timeout))
+
+    def serialize(self, body):
+        if body is None or isinstance(body, str):
+            return body
+        if isinstance(body, (list, tuple)):
+            # Newline delimited, for _bulk and _msearch.
+            return "".join(self.serializer.dumps(line) + "\n" for line in body)
+        return self.serializer.dumps(body)
+
+    async def perform_request(self, method, path, params=None, body=None):
+        params = dict((k, v if isinstance(v, str) else json.dumps(v))
+                      for k, v in (params or {}).items())
+        headers = {'Content-Type': 'application/json'}
+        data = self.serialize(body)
+
+        for attempt in range(self.max_retries + 1):
+            url, auth, ssl_context = next(self.next_host)
+            try:
+                async with self.session.request(method, url + path, params=params,
+                                                headers=headers, data=data, auth=auth,
+                                                ssl=ssl_context) as response:
+                    status = response.status
+                    text = await response.text()
+                break
+            except asyncio.TimeoutError as e:
+                if not self.retry_on_timeout or attempt == self.max_retries:
+                    raise exceptions.ConnectionTimeout('TIMEOUT', str(e), e)
+            except aiohttp.ClientConnectionError as e:
+                if attempt == self.max_retries:
+                    raise exceptions.ConnectionError('N/A', str(e), e)
+
+        data = json.loads(text) if text else {}
+        if not 200 <= status < 300:
+            error = data.get('error', text) if isinstance(data, dict) else text
+            raise TransportError(status, error, data)
+        return data
+
+    async def close(self):
+        await self.session.close()
+
+
+def get_transport(connection='default'):
+    """
+    Returns the AsyncTransport for a connection in ELASTICSEARCH_CONNECTIONS,
+    for the running event loop.
+    """
+    loop = asyncio.get_event_loop()
+    transports = _transports.setdefault(loop, {})
+    if connection not in transports:
+        options = get_connection_options(connection)
+        options.update(settings.ELASTICSEARCH_CONNECTIONS[connection].get('ASYNC_OPTIONS', {}))
+        transports[connection] = AsyncTransport(**options)
+    return transports[connection]
+
+async def close_transports():
+    """
+    Closes the transports of the running event loop, e.g. on ASGI shutdown.
+    """
+    transports = _transports.pop(asyncio.get_event_loop(), {})
+    for transport in transports.values():
+        await transport.close()
+
+def get_path(search, endpoint):
+    return "/%s/%s/%s" % (",".join(search._index or ['_all']),
+                          ",".join(search._doc_type), endpoint)
+
+async def aexecute(search, response_class=Response):
+    """
+    Executes an IndexSearch without blocking the event loop.  Like
+    Search.execute, the response is kept, and returned by later calls.
+    """
+    if hasattr(search, '_response'):
+        return search._response
+
+    body = search.to_dict()
+    cache = get_result_cache()
+    key = None
+    data = None
+    if cache is not None and isinstance(search, CachedSearch):
+        key, data = cache.lookup(search._index, search.get_request(body=body))
+
+    if data is None:
+        data = await get_transport(search._connection).perform_request(
+            'POST', get_path(search, '_search'), params=search._params, body=body)
+        if key is not None:
+            cache.store(key, data)
+
+    search._response = response_class(data, callbacks=search._doc_type_map)
+    return search._response
+
+async def acount(search):
+    if hasattr(search, '_response'):
+        return search._response.hits.total
+
+    body = search.to_dict(count=True)
+    cache = get_result_cache()
+    if cache is not None and isinstance(search, CachedSearch):
+        key, count = cache.lookup(search._index, search.get_request(count=body))
+        if count is not None:
+            return count
+
+    data = await get_transport(search._connection).perform_request(
+        'POST', get_path(search, '_count'), body=body)
+    if cache is not None and isinstance(search, CachedSearch):
+        cache.store(key, data['count'])
+    return data['count']
+
+async def asend(index, actions):
+    """
+    Sends bulk actions for index in one request, returning the number of
+    successful items and raising a BulkIndexError for the ones that failed.
+    """
+    actions = list(actions)
+    if not actions:
+        return 0
+    lines = []
+    indexes = set()
+    for data in actions:
+        action, source = expand_action(data)
+        indexes.update(meta['_index'] for meta in action.values())
+        lines.append(action)
+        if source is not None:
+            lines.append(source)
+
+    try:
+        response = await get_transport(index._meta.connection).perform_request(
+            'POST', '/_bulk', body=lines)
+    finally:
+        # As invalidate_results does, without blocking the loop.
+        cached = get_cached_indexes(indexes) if get_result_cache() is not None else {}
+        for connection, names in cached.items():
+            try:
+                await get_transport(connection).perform_request(
+                    'POST', '/%s/_refresh' % ",".join(sorted(names)))
+            except TransportError as e:
+                logger.warning("Failed to refresh %s before discarding their cached results: %s"
+                               % (", ".join(sorted(names)), e))
+        invalidate_results(indexes, refresh=False)
+
+    sent = []
+    errors = []
+    for data, item in zip(actions, response['items']):
+        op_type, result = item.popitem()
+        if 200 <= result.get('status', 500) < 300 or (
+                result.get('status') == 404 and op_type == 'delete'):
+            sent.append(data)
+        else:
+            result['data'] = data
+            errors.append({op_type: result})
+    record_fingerprints(sent)
+
+    if errors:
+        raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+    return len(sent)
+
+async def aindex_instance(index, instance):
+    """
+    Indexes instance without blocking the event loop.  Its document is
+    prepared in the loop's default executor, since that queries the database.
+    """
+    def prepare():
+        try:
+            return list(index.get_instance_actions([instance]))
+        finally:
+            # Nothing else closes the executor thread's connections.
+            close_db_connections()
+
+    loop = asyncio.get_event_loop()
+    actions = await loop.run_in_executor(None, prepare)
+    return await asend(index, actions)
+
+async def aindex_queryset(index, qs):
+    """
+    Indexes the instances in qs, a chunk at a time, without blocking the
+    event loop.  Each chunk is fetched and prepared in a thread of its own
+    while the previous one is sent.
+    """
+    loop = asyncio.get_event_loop()
+    # One thread, so the chunks share its database connection.
+    executor = ThreadPoolExecutor(max_workers=1)
+    chunks = index.get_chunks(qs)
+
+    def prepare():
+        instances = next(chunks, None)
+        if instances is None:
+            return None
+        return list(index.get_instance_actions(instances))
+
+    success = 0
+    sending = None
+    try:
+        while True:
+            actions = await loop.run_in_executor(executor, prepare)
+            if sending is not None:
+                success += await sending
+            if actions is None:
+                break
+            sending = asyncio.ensure_future(asend(index, actions))
+    finally:
+        await loop.run_in_executor(executor, close_db_connections)
+        executor.shutdown(wait=False)
+    return success
+
+
+if django.VERSION >= (4, 1):
+    from asgiref.sync import sync_to_async
+
+    class AsyncSearchListView(SearchListView):
+        """
+        A SearchListView whose handler is a coroutine, which needs Django 4.1.
+        The count used for pagination and the facet searches are requested
+        concurrently, followed by the page itself.  Instances are loaded (with
+        load_models) in a thread.
+        """
+        async def get(self, request, *args, **kwargs):
+            self.search = self.get_search()
+            context = await self.aget_context_data()
+            return self.render_to_response(context)
+
+        async def aget_context_data(self, **kwargs):
+            facet_searches = self.get_facet_searches()
+            names = list(facet_searches)
+            results = await asyncio.gather(
+                self.search.acount(), *[facet_searches[name].aexecute() for name in names])
+            self.count = results[0]
+            facets = dict(zip(names, results[1:]))
+
+            page_size = self.get_paginate_by(self.search)
+            paginator, page, search, is_paginated = self.paginate_search(self.search, page_size)
+            result = await search.aexecute()
+
+            context = {
+                'paginator': paginator,
+                'page_obj': page,
+                'is_paginated': is_paginated,
+                'search_result': result,
+                'hits': result.hits,
+                'facets': facets,
+            }
+
+            if self.load_models:
+                context['object_list'] = await sync_to_async(self.get_model_list)(result)
+
+            context.update(kwargs)
+            return super(SearchListView, self).get_context_data(**context)
@@ -0,0 +1,16 @@
+from django.apps import AppConfig
+
+
+class ElasticModelsConfig(AppConfig):
+    name = 'elastic_models'
+
+    def ready(self):
+        from . import receivers
+        from .hydration import invalidate_changed_instances
+        from .indexes import build_dispatch_table
+        from .signals import instances_changed
+
+        build_dispatch_table()
+        receivers.connect_delete_receivers()
+        instances_changed.connect(invalidate_changed_instances,
+                                  dispatch_uid='elastic_models.hydration')
@@ -0,0 +1,231 @@
+from __future__ import absolute_import
+
+import logging
+import threading
+from collections import defaultdict, OrderedDict
+from itertools import chain
+
+from django.db import transaction, DEFAULT_DB_ALIAS
+
+from . import outbox
+from .models import OutboxEntry
+from .sender import BulkSender
+from .signals import instances_changed
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+_buffers = threading.local()
+
+
+class IndexBuffer(object):
+    """
+    Collects the (index, pk) pairs written during a database transaction and
+    sends them to elasticsearch in a single bulk request once the transaction
+    commits.  Nothing is sent if the transaction is rolled back.
+
+    Instances are reloaded from the database when the buffer is flushed, so
+    each document reflects the committed state of its row, no matter how many
+    times it was saved.  Rows that are gone, or no longer belong in the
+    index, have their documents deleted.
+
+    When only some fields of a document need updating, they are sent as a
+    partial update.  Documents that turn out not to exist yet are indexed in
+    full instead.
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        # Maps each index to a dictionary mapping pks to the names of the
+        # fields to update, or None to index the whole document.
+        self.pending = defaultdict(dict)
+        # Maps each index to the pks of the documents to delete.
+        self.deletes = defaultdict(set)
+        # Maps (index, field name, model, pk) to the latest saved instance
+        # to copy into the index's documents.  See Index.fanout.
+        self.fanouts = OrderedDict()
+        self.scheduled = False
+
+    def __len__(self):
+        return (sum(len(pks) for pks in self.pending.values()) +
+                sum(len(pks) for pks in self.deletes.values()) +
+                len(self.fanouts))
+
+    def add(self, index, pk, fields=None):
+        self.deletes[index].discard(pk)
+        pending = self.pending[index]
+        if fields is None or pending.get(pk, ()) is None:
+            pending[pk] = None
+        else:
+            pending[pk] = pending.get(pk, frozenset()) | frozenset(fields)
+
+    def add_delete(self, index, pk):
+        self.pending[index].pop(pk, None)
+        self.deletes[index].add(pk)
+
+    def add_fanout(self, index, name, instance):
+        key = (index, name, type(instance), instance.pk)
+        self.fanouts.pop(key, None)
+        self.fanouts[key] = instance
+
+    def schedule(self):
+        if self.scheduled:
+            return
+        self.scheduled = True
+
+        if hasattr(transaction, 'on_commit'):
+            # Runs immediately when we are not inside an atomic block.
+            transaction.on_commit(self.flush, using=self.using)
+        else:
+            self.flush()
+
+    def is_pending(self):
+        """
+        Returns whether our on_commit hook is still registered.  Django drops
+        the hook when the (savepoint) transaction it was registered in is
+        rolled back.
+        """
+        if not self.scheduled or not hasattr(transaction, 'on_commit'):
+            return False
+        connection = transaction.get_connection(self.using)
+        return any(hook[1] == self.flush for hook in connection.run_on_commit)
+
+    def get_actions(self):
+        actions = defaultdict(list)
+        clients = {}
+
+        for index, pks in self.pending.items():
+            connection = index._meta.connection
+            clients[connection] = index.get_es()
+
+            updates = defaultdict(list)
+            for pk, fields in pks.items():
+                updates[fields].append(pk)
+
+            for fields, pks in updates.items():
+                for chunk in chunked(sorted(pks), index._meta.index_by):
+                    actions[connection].append(index.get_pk_actions(chunk, fields))
+
+        for index, pks in self.deletes.items():
+            if pks:
+                connection = index._meta.connection
+                clients[connection] = index.get_es()
+                actions[connection].append(index.get_delete_actions(sorted(pks)))
+
+        return [(clients[c], chain.from_iterable(a)) for c, a in actions.items()]
+
+    def get_missing_actions(self, missing):
+        """
+        Returns actions indexing the whole documents for a list of partial
+        update actions whose documents didn't exist.
+        """
+        indexes = dict(((index.get_index(), index.get_doc_type()), index)
+                       for index in self.pending)
+        pks = defaultdict(list)
+        for action in missing:
+            pks[indexes[action['_index'], action['_type']]].append(action['_id'])
+
+        return chain.from_iterable(
+            index.get_pk_actions(chunk)
+            for index, index_pks in pks.items()
+            for chunk in chunked(sorted(index_pks), index._meta.index_by))
+
+    def flush(self):
+        if getattr(_buffers, self.using, None) is self:
+            delattr(_buffers, self.using)
+
+        if not len(self):
+            return
+
+        logger.debug("Flushing %d buffered index updates" % len(self))
+        try:
+            # The transaction has committed, so instances loaded from now on
+            # are current.
+            for index, pks in chain(self.pending.items(), self.deletes.items()):
+                instances_changed.send(sender=index.model, pks=list(pks))
+
+            for client, actions in self.get_actions():
+                sender = BulkSender(client)
+                sender.send(actions)
+                if sender.missing:
+                    sender.send(self.get_missing_actions(sender.missing))
+
+            for (index, name, model, pk), instance in self.fanouts.items():
+                index.fanout(name, instance)
+        finally:
+            self.pending.clear()
+            self.deletes.clear()
+            self.fanouts.clear()
+
+
+def get_buffer(using=None):
+    """
+    Returns the buffer collecting updates for the current transaction on the
+    given database, starting a new one if the previous buffer was flushed or
+    its transaction rolled back.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    buffer = getattr(_buffers, using, None)
+    if buffer is None or (buffer.scheduled and not buffer.is_pending()):
+        buffer = IndexBuffer(using)
+        setattr(_buffers, using, buffer)
+    return buffer
+
+
+def queue_index(index, pk, using=None, fields=None):
+    """
+    Queues the document for pk to be indexed when the current transaction
+    commits.  If fields is given, only the named fields are updated.
+
+    If the ELASTICSEARCH_OUTBOX setting is True, an outbox entry is written
+    in the current transaction instead.
+    """
+    if outbox.is_enabled():
+        # The index_worker command sends the whole document.
+        outbox.add_entry(index, pk, using=using)
+        return
+
+    buffer = get_buffer(using)
+    buffer.add(index, pk, fields)
+    buffer.schedule()
+
+
+def queue_delete(index, pk, using=None):
+    """
+    Queues the document for pk to be deleted when the current transaction
+    commits.
+    """
+    if outbox.is_enabled():
+        outbox.add_entry(index, pk, op=OutboxEntry.DELETE, using=using)
+        return
+
+    buffer = get_buffer(using)
+    buffer.add_delete(index, pk)
+    buffer.schedule()
+
+
+def queue_fanout(index, name, instance, using=None):
+    """
+    Queues instance to be copied into the field called name of index's
+    documents when the current transaction commits.
+    """
+    if outbox.is_enabled():
+        outbox.add_entry(index, instance.pk, op=OutboxEntry.FANOUT, field=name,
+                         using=using)
+        return
+
+    buffer = get_buffer(using)
+    buffer.add_fanout(index, name, instance)
+    buffer.schedule()
+
+
+def flush_buffers():
+    """
+    Sends any updates buffered by the current thread without waiting for the
+    transaction to commit.  Buffers whose transaction was rolled back are
+    discarded.
+    """
+    for using, buffer in list(_buffers.__dict__.items()):
+        if buffer.is_pending():
+            buffer.flush()
+        else:
+            delattr(_buffers, using)
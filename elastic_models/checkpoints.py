@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from django.conf import settings
+from django.utils import six
+
+
+class CheckpointLocked(Exception):
+    pass
+
+
+def get_checkpoint_dir():
+    return getattr(settings, 'ELASTICSEARCH_CHECKPOINT_DIR',
+                   os.path.join(tempfile.gettempdir(), 'elastic_models'))
+
+
+class Checkpoint(object):
+    """
+    Records the progress of an indexing run in a local file, so that the run
+    can be resumed after an interruption.  last_pk is the primary key of the
+    last instance indexed, and count is the number of instances indexed so
+    far.  For runs split across several processes, ranges records the
+    primary key range assigned to each process, each of which has its own
+    checkpoint (see get_range_checkpoint).  Anything else needed to resume
+    the run can be stored in the extra dictionary.
+
+    Primary keys are stored as text, so any type of key can be saved.  If
+    model is given, they are converted back by its primary key field when
+    loaded.
+    """
+    def __init__(self, name, directory=None, model=None):
+        self.name = name
+        self.directory = directory or get_checkpoint_dir()
+        self.model = model
+        self.last_pk = None
+        self.count = 0
+        self.ranges = None
+        self.extra = {}
+        self.load()
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, "%s.json" % self.name)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        self.last_pk = self.load_pk(data.get('last_pk'))
+        self.count = data.get('count', 0)
+        self.ranges = data.get('ranges')
+        if self.ranges is not None:
+            self.ranges = [tuple(self.load_pk(pk) for pk in r) for r in self.ranges]
+        self.extra = data.get('extra', {})
+
+    def load_pk(self, pk):
+        if pk is None or self.model is None:
+            return pk
+        return self.model._meta.pk.to_python(pk)
+
+    def dump_pk(self, pk):
+        return None if pk is None else six.text_type(pk)
+
+    def save(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        # Write to a temporary file first so that a crash never leaves a
+        # partially written checkpoint.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as f:
+            ranges = self.ranges
+            if ranges is not None:
+                ranges = [[self.dump_pk(pk) for pk in r] for r in ranges]
+            json.dump({
+                'last_pk': self.dump_pk(self.last_pk),
+                'count': self.count,
+                'ranges': ranges,
+                'extra': self.extra,
+            }, f)
+        os.rename(tmp_path, self.path)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def get_range_checkpoint(self, number):
+        return Checkpoint("%s.%d" % (self.name, number), self.directory, self.model)
+
+    def update(self, last_pk, count):
+        self.last_pk = last_pk
+        self.count += count
+        self.save()
+
+    def clear(self):
+        for number in range(len(self.ranges or ())):
+            self.get_range_checkpoint(number).clear()
+
+        self.last_pk = None
+        self.count = 0
+        self.ranges = None
+        self.extra = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @contextmanager
+    def lock(self):
+        """
+        Holds an exclusive lock on the checkpoint while the block runs, so
+        overlapping runs (e.g. from cron) don't both use it.  Raises
+        CheckpointLocked if another process holds the lock.  Locks are only
+        taken where fcntl is available.
+        """
+        if fcntl is None:
+            yield
+            return
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(os.path.join(self.directory, "%s.lock" % self.name), 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                raise CheckpointLocked("%s is in use by another process" % self.name)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,118 @@
+from __future__ import absolute_import
+
+import os
+import re
+import threading
+import warnings
+
+from django.conf import settings
+
+import elasticsearch
+from elasticsearch import Elasticsearch
+
+# Maps connection names to their clients, which are shared by all threads.
+_clients = {}
+_lock = threading.Lock()
+# The process the clients belong to.
+_pid = [os.getpid()]
+# Maps connection names to the versions of their clusters.
+_versions = {}
+
+
+def get_connection_options(connection):
+    """
+    Returns the keyword arguments for the Elasticsearch client of a
+    connection in ELASTICSEARCH_CONNECTIONS: its HOSTS, and its OPTIONS,
+    which are passed to the client's Transport and connections.  For
+    example:
+
+        'OPTIONS': {
+            'maxsize': 25,              # Connections kept open per host
+            'timeout': 30,
+            'max_retries': 3,
+            'retry_on_timeout': True,
+            'sniff_on_start': True,
+            'sniff_on_connection_fail': True,
+            'sniffer_timeout': 60,
+        }
+    """
+    config = settings.ELASTICSEARCH_CONNECTIONS[connection]
+    options = dict(config.get('OPTIONS', {}))
+    if options.get('http_compress') and elasticsearch.VERSION < (6, 0, 0):
+        warnings.warn("http_compress is ignored before elasticsearch-py 6.0")
+    options['hosts'] = config['HOSTS']
+    return options
+
+def _reset_after_fork():
+    global _lock
+    # Another thread may have held the lock when the process forked.
+    _lock = threading.Lock()
+    _clients.clear()
+    _pid[0] = os.getpid()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def get_es(connection='default'):
+    """
+    Returns the client for a connection in ELASTICSEARCH_CONNECTIONS.  Each
+    process has one client per connection, shared by its threads, so they
+    share its connection pool.  A forked process starts with new clients,
+    rather than sharing its parent's sockets.
+    """
+    if os.getpid() != _pid[0]:
+        _reset_after_fork()
+
+    client = _clients.get(connection)
+    if client is None:
+        with _lock:
+            client = _clients.get(connection)
+            if client is None:
+                client = Elasticsearch(**get_connection_options(connection))
+                _clients[connection] = client
+    return client
+
+def reset_connections():
+    """
+    Discards the elasticsearch clients, so they are created again (e.g.
+    after changing ELASTICSEARCH_CONNECTIONS).
+    """
+    with _lock:
+        _clients.clear()
+        _versions.clear()
+
+def get_cluster_version(connection='default'):
+    """
+    Returns the version of a connection's cluster, as a tuple of integers
+    like (5, 6, 0).  The cluster is only asked once per process.
+    """
+    version = _versions.get(connection)
+    if version is None:
+        number = get_es(connection).info()['version']['number']
+        version = tuple(int(part) for part in re.findall(r'\d+', number)[:3])
+        _versions[connection] = version
+    return version
+
+def get_pool_stats():
+    """
+    Returns a dictionary mapping the name of each connection with a client
+    to a list of statistics about the connection pool for each of its hosts:
+    the number of connections opened and requests made, and how many more
+    requests could run at once.
+    """
+    stats = {}
+    with _lock:
+        clients = list(_clients.items())
+    for name, client in clients:
+        stats[name] = []
+        for connection in client.transport.connection_pool.connections:
+            pool = getattr(connection, 'pool', None)
+            if pool is None:
+                continue
+            stats[name].append({
+                'host': connection.host,
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'available': pool.pool.qsize() if pool.pool is not None else 0,
+            })
+    return stats
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+
+from collections import defaultdict
+
+
+class DependencyGraph(object):
+    """
+    The resolved dependencies of a set of indexes.
+
+    Forward edges map each index to the models whose changes affect its
+    documents, along with the lookup path from the index's model to each of
+    them.  Reverse edges map a changed model back to the dependent indexes.
+
+    Dependencies are followed transitively through the indexes of the
+    dependency models: if BlogPost's index depends on Author through
+    'author', and Author's index depends on Address through 'address', then
+    BlogPost's index also depends on Address through 'author__address'.
+    """
+    def __init__(self, indexes):
+        direct = dict((index, index.get_dependencies()) for index in indexes)
+
+        forward = {}
+        reverse = defaultdict(list)
+        for index, dependencies in direct.items():
+            edges = []
+            self._follow(dependencies, direct, (), set([index.model]), edges)
+            forward[index] = tuple(edges)
+
+            paths = defaultdict(list)
+            for model, path in edges:
+                paths[model].append(path)
+            for model, model_paths in paths.items():
+                reverse[model].append((index, tuple(model_paths)))
+
+        self._forward = forward
+        self._reverse = dict((m, tuple(e)) for m, e in reverse.items())
+
+    def _follow(self, dependencies, direct, prefix, seen, edges):
+        for model, query in dependencies.items():
+            # Followed paths leading back to the index's model, or to a model
+            # already on the path, are dependency cycles.  Declared ones, like
+            # a model's dependency on its parent, are kept but not followed.
+            if prefix and model in seen:
+                continue
+
+            path = prefix + (query,)
+            edge = (model, "__".join(path))
+            if edge not in edges:
+                edges.append(edge)
+
+            if model in seen:
+                continue
+
+            for index, model_dependencies in direct.items():
+                if issubclass(model, index.model):
+                    self._follow(model_dependencies, direct, path,
+                                 seen | set([model]), edges)
+
+    def get_dependencies(self, index):
+        """
+        Returns a tuple of (model, path) pairs for the models index depends on.
+        """
+        return self._forward.get(index, ())
+
+    def get_dependency_models(self, index):
+        return set(model for (model, path) in self.get_dependencies(index))
+
+    def get_dependents(self, model):
+        """
+        Returns a tuple of (index, paths) pairs for the indexes that depend on
+        model.  paths is a tuple of the lookups that select the instances of
+        the index's model that depend on an instance of model.
+        """
+        return self._reverse.get(model, ())
@@ -1,11 +1,94 @@
+import operator
+
+from django.core.exceptions import FieldDoesNotExist
 from django.template.loader import render_to_string
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
 from django.utils import six
 
 import elasticsearch_dsl as dsl
 
 from .utils import merge, getattr_or_callable
 
+def _uses(field, cls, *names):
+    """
+    Returns whether field uses cls's implementation of each of the named
+    methods, rather than an override.
+    """
+    for name in names:
+        method = six.get_unbound_function(getattr(type(field), name))
+        if method is not six.get_unbound_function(getattr(cls, name)):
+            return False
+    return True
+
+def _get_model_field(model, name):
+    if model is None:
+        return None
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+def _is_plain_column(model, field):
+    """
+    Returns whether the value of field is stored on model instances as is,
+    rather than being wrapped by a descriptor (as FileField's values are).
+    """
+    if not field.concrete or field.is_relation:
+        return False
+    descriptor = getattr(model, field.attname, None)
+    return descriptor is None or isinstance(descriptor, DeferredAttribute)
+
+def _compile_path(path, model):
+    """
+    Returns a function equivalent to AttributeField.get_attr_from_instance
+    for path on instances of model, and the model the path leads to, if
+    known.
+    """
+    steps = []
+    for name in path:
+        field = _get_model_field(model, name)
+        if model is not None and name == 'pk':
+            steps.append(_column_step(name, model._meta.pk.attname))
+            model = None
+        elif field is not None and _is_plain_column(model, field):
+            steps.append(_column_step(name, field.attname))
+            model = None
+        elif field is not None and field.concrete and field.related_model is not None \
+                and (field.many_to_one or field.one_to_one) \
+                and '__call__' not in dir(field.related_model):
+            # Related instances can't be called, so the dynamic checks are
+            # unnecessary.
+            steps.append(operator.attrgetter(name))
+            model = field.related_model
+        else:
+            steps.append(_dynamic_step(name))
+            model = getattr(field, 'related_model', None)
+
+    def get_attr(instance):
+        try:
+            for step in steps:
+                instance = step(instance)
+            return instance
+        except AttributeError:
+            return None
+    return get_attr, model
+
+def _column_step(name, attname):
+    def step(instance):
+        try:
+            return instance.__dict__[attname]
+        except (KeyError, AttributeError):
+            # Deferred, or not a model instance.
+            return getattr_or_callable(instance, name)
+    return step
+
+def _dynamic_step(name):
+    def step(instance):
+        return getattr_or_callable(instance, name)
+    return step
+
+
 class SearchField(object):
     dsl_field = dsl.String
     
@@ -26,16 +109,37 @@ class SearchField(object):
     def get_from_instance(self, instance):
         return None
 
+    def get_paths(self):
+        """
+        Returns a list of the attribute paths read by get_from_instance, or
+        None if they can't be determined.
+        """
+        return None
+
+    def compile(self, model):
+        """
+        Returns a function equivalent to get_from_instance, specialized for
+        instances of model (which may be None if it is unknown).
+        """
+        return self.get_from_instance
+
 
 class TemplateField(SearchField):
-    def __init__(self, template_name):
+    def __init__(self, template_name, depends_on=None):
         super(TemplateField, self).__init__()
         self.template_name = template_name
+        # The attributes (or dotted paths) the template reads, if known.
+        self.depends_on = depends_on
 
     def get_from_instance(self, instance):
         context = {'object': instance}
         return render_to_string(self.template_name, context)
 
+    def get_paths(self):
+        if self.depends_on is None:
+            return None
+        return [tuple(attr.split(".")) for attr in self.depends_on]
+
 
 class AttributeField(SearchField):
     def __init__(self, attr, **kwargs):
@@ -57,6 +161,29 @@ class AttributeField(SearchField):
         value = self.get_attr_from_instance(instance)
         return self.prepare(value)
 
+    def get_paths(self):
+        return [tuple(self.path)]
+
+    def get_compiled_prepare(self, model):
+        """
+        Returns the function used to prepare values of model read by a
+        compiled field.
+        """
+        return self.prepare
+
+    def compile(self, model):
+        if not _uses(self, AttributeField, 'get_from_instance', 'get_attr_from_instance'):
+            return self.get_from_instance
+
+        get_attr, related_model = _compile_path(self.path, model)
+        prepare = self.get_compiled_prepare(related_model)
+        if _uses(self, AttributeField, 'prepare'):
+            return get_attr
+
+        def get_from_instance(instance):
+            return prepare(get_attr(instance))
+        return get_from_instance
+
 
 class ListMixin(AttributeField):
     def __init__(self, *args, **kwargs):
@@ -69,6 +196,21 @@ class ListMixin(AttributeField):
             values = values.all()
         return [self.prepare(v) for v in values]
 
+    def compile(self, model):
+        if not _uses(self, ListMixin, 'get_from_instance') or \
+                not _uses(self, AttributeField, 'get_attr_from_instance'):
+            return self.get_from_instance
+
+        get_attr, related_model = _compile_path(self.path, model)
+        prepare = self.get_compiled_prepare(related_model)
+
+        def get_from_instance(instance):
+            values = get_attr(instance)
+            if hasattr(values, 'all'):
+                values = values.all()
+            return [prepare(v) for v in values]
+        return get_from_instance
+
 
 class StringField(AttributeField):
     def prepare(self, value):
@@ -238,9 +380,51 @@ class FieldMappingMixin(six.with_metaclass(DeclarativeSearchFieldMetaclass)):
         return merge([f.get_field_settings() for f in self.fields.values()])
     
     def prepare(self, instance):
+        return self.get_serializer(getattr(self, 'model', None))(instance)
+
+    def prepare_dynamic(self, instance):
+        """
+        Prepares instance without compiling the fields.  The result is the
+        same as prepare's.
+        """
         return dict((name, field.get_from_instance(instance))
                     for name, field in self.fields.items())
 
+    def get_serializer(self, model, names=None):
+        """
+        Returns a function that prepares instances of model, compiled from
+        the fields once.  Model columns are read straight from the instance,
+        and attributes are only looked up dynamically where needed.
+
+        If names (a frozenset) is given, only those fields are prepared.
+        """
+        serializers = self.__dict__.setdefault('_em_serializers', {})
+        key = (model, names)
+        if key not in serializers:
+            extractors = [(name, field.compile(model))
+                          for name, field in self.fields.items()
+                          if names is None or name in names]
+
+            def serialize(instance):
+                return dict((name, extract(instance)) for name, extract in extractors)
+            serializers[key] = serialize
+        return serializers[key]
+
+    def get_field_paths(self):
+        """
+        Returns the attribute paths read by the fields, and whether all of the
+        fields' paths could be determined.
+        """
+        paths = []
+        complete = True
+        for field in self.fields.values():
+            field_paths = field.get_paths()
+            if field_paths is None:
+                complete = False
+            else:
+                paths.extend(field_paths)
+        return paths, complete
+
 class ObjectField(FieldMappingMixin, AttributeField):
     dsl_field = dsl.Object
     
@@ -255,5 +439,19 @@ class ObjectField(FieldMappingMixin, AttributeField):
         self.add_fields_to_mapping(field)
         return field
 
+    def get_compiled_prepare(self, model):
+        if not _uses(self, FieldMappingMixin, 'prepare'):
+            return self.prepare
+        return self.get_serializer(model or getattr(self, 'model', None))
+
+    def get_paths(self):
+        path = tuple(self.path)
+        paths, complete = self.get_field_paths()
+        paths = [path + p for p in paths]
+        if not complete:
+            # Some sub-field may read anything from the object.
+            paths.append(path)
+        return paths
+
 class NestedObjectListField(ListMixin, ObjectField):
     dsl_field = dsl.Nested
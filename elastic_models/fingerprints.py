@@ -0,0 +1,239 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from elasticsearch.serializer import JSONSerializer
+
+from .utils import chunked
+
+_store = []
+_store_lock = threading.Lock()
+
+
+def get_fingerprint_store():
+    """
+    Returns the FingerprintStore configured by the ELASTICSEARCH_FINGERPRINTS
+    setting, or None if there isn't one.  The setting is a dictionary like
+    the ones in CACHES, with a BACKEND class path and OPTIONS passed to it.
+    """
+    with _store_lock:
+        if not _store:
+            config = getattr(settings, 'ELASTICSEARCH_FINGERPRINTS', None)
+            store = None
+            if config:
+                store = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            _store.append(store)
+        return _store[0]
+
+def reset_fingerprint_store():
+    with _store_lock:
+        del _store[:]
+
+def get_namespace(index, doc_type):
+    return "%s/%s" % (index, doc_type)
+
+def fingerprint(document):
+    """
+    Returns a hash of document's content, independent of key order.
+    """
+    data = json.dumps(document, sort_keys=True, default=JSONSerializer().default)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+def record_fingerprints(actions):
+    """
+    Stores the fingerprints attached (by Index.get_instance_actions) to bulk
+    actions that were sent successfully.
+    """
+    store = get_fingerprint_store()
+    if store is None:
+        return
+
+    sent = defaultdict(dict)
+    for action in actions:
+        if isinstance(action, dict) and '_fingerprint' in action:
+            namespace = get_namespace(action['_index'], action['_type'])
+            sent[namespace][action['_id']] = action['_fingerprint']
+    for namespace, fingerprints in sent.items():
+        store.set_many(namespace, fingerprints)
+
+
+class FingerprintStore(object):
+    """
+    Remembers a fingerprint of the last document sent for each primary key
+    in an index, so documents that haven't changed since can be skipped.
+    hits counts the documents skipped, and misses the ones sent.
+
+    Subclasses implement get_many, set_many, delete_many and invalidate.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, namespace, pks):
+        """
+        Returns a dictionary mapping the pks that have a fingerprint to it.
+        """
+        raise NotImplementedError
+
+    def set_many(self, namespace, fingerprints):
+        raise NotImplementedError
+
+    def delete_many(self, namespace, pks):
+        raise NotImplementedError
+
+    def invalidate(self, namespace):
+        """
+        Discards all of the fingerprints in namespace.
+        """
+        raise NotImplementedError
+
+    def get_changed(self, namespace, documents):
+        """
+        Returns (pk, document, fingerprint) tuples for the (pk, document)
+        pairs in documents whose fingerprint differs from the one stored.
+        The new fingerprints should be stored once the documents are sent.
+        """
+        fingerprints = dict((pk, fingerprint(document)) for pk, document in documents)
+        previous = self.get_many(namespace, list(fingerprints))
+        changed = [(pk, document, fingerprints[pk]) for pk, document in documents
+                   if previous.get(pk) != fingerprints[pk]]
+
+        with self.lock:
+            self.hits += len(documents) - len(changed)
+            self.misses += len(changed)
+        return changed
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class CacheFingerprintStore(FingerprintStore):
+    """
+    Stores fingerprints in one of the caches in the CACHES setting.  Its
+    backend's culling (e.g. memcached's LRU eviction, or MAX_ENTRIES for the
+    local memory cache) bounds the size of the store.
+    """
+    def __init__(self, alias='default', timeout=None, key_prefix='elastic_models.fingerprint'):
+        super(CacheFingerprintStore, self).__init__()
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def get_version(self, namespace):
+        # Changed by invalidate, since cache keys can't be enumerated.  A new
+        # version is chosen if the cache evicted it, so older fingerprints
+        # are never used again.
+        key = self.make_key(namespace, 'version')
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, repr(time.time()), None)
+            version = self.cache.get(key)
+        return version
+
+    def make_key(self, namespace, pk, version=0):
+        # Hashed, since memcached doesn't allow spaces or long keys.
+        key = "%s/%s/%s" % (version, namespace, pk)
+        return "%s:%s" % (self.key_prefix, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+    def get_keys(self, namespace, pks):
+        version = self.get_version(namespace)
+        return dict((self.make_key(namespace, pk, version), pk) for pk in pks)
+
+    def get_many(self, namespace, pks):
+        keys = self.get_keys(namespace, pks)
+        values = self.cache.get_many(list(keys))
+        return dict((keys[key], value) for key, value in values.items())
+
+    def set_many(self, namespace, fingerprints):
+        keys = self.get_keys(namespace, fingerprints)
+        self.cache.set_many(dict((key, fingerprints[pk]) for key, pk in keys.items()),
+                            self.timeout)
+
+    def delete_many(self, namespace, pks):
+        self.cache.delete_many(list(self.get_keys(namespace, pks)))
+
+    def invalidate(self, namespace):
+        self.cache.set(self.make_key(namespace, 'version'), repr(time.time()), None)
+
+
+class SQLiteFingerprintStore(FingerprintStore):
+    """
+    Stores fingerprints in a local SQLite file holding at most max_entries
+    of them.  The least recently used fingerprints are evicted first.
+    """
+    def __init__(self, path, max_entries=1000000):
+        super(SQLiteFingerprintStore, self).__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+
+    def get_connection(self):
+        # SQLite connections can't be shared between threads.
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("CREATE TABLE IF NOT EXISTS fingerprints ("
+                               "key TEXT PRIMARY KEY, fingerprint TEXT, used REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS fingerprints_used "
+                               "ON fingerprints (used)")
+            connection.commit()
+            self.local.connection = connection
+        return self.local.connection
+
+    def make_key(self, namespace, pk):
+        return u"%s/%s" % (namespace, pk)
+
+    def get_many(self, namespace, pks):
+        keys = dict((self.make_key(namespace, pk), pk) for pk in pks)
+        connection = self.get_connection()
+        found = {}
+        # Stay below SQLite's limit on query parameters.
+        for chunk in chunked(keys, 500):
+            rows = connection.execute(
+                "SELECT key, fingerprint FROM fingerprints WHERE key IN (%s)"
+                % ", ".join("?" * len(chunk)), chunk)
+            found.update((keys[key], value) for key, value in rows)
+
+        if found:
+            now = time.time()
+            with connection:
+                connection.executemany("UPDATE fingerprints SET used = ? WHERE key = ?",
+                                       [(now, self.make_key(namespace, pk)) for pk in found])
+        return found
+
+    def set_many(self, namespace, fingerprints):
+        now = time.time()
+        connection = self.get_connection()
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO fingerprints (key, fingerprint, used) VALUES (?, ?, ?)",
+                [(self.make_key(namespace, pk), value, now)
+                 for pk, value in fingerprints.items()])
+            count, = connection.execute("SELECT COUNT(*) FROM fingerprints").fetchone()
+            if count > self.max_entries:
+                connection.execute(
+                    "DELETE FROM fingerprints WHERE key IN "
+                    "(SELECT key FROM fingerprints ORDER BY used LIMIT ?)",
+                    (count - self.max_entries,))
+
+    def delete_many(self, namespace, pks):
+        connection = self.get_connection()
+        with connection:
+            connection.executemany("DELETE FROM fingerprints WHERE key = ?",
+                                   [(self.make_key(namespace, pk),) for pk in pks])
+
+    def invalidate(self, namespace):
+        prefix = self.make_key(namespace, u"")
+        connection = self.get_connection()
+        with connection:
+            connection.execute("DELETE FROM fingerprints WHERE substr(key, 1, ?) = ?",
+                               (len(prefix), prefix))
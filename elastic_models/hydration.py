@@ -0,0 +1,180 @@
+from __future__ import absolute_import
+
+import hashlib
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .buffer import queue_delete
+from .indexes import index_registry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEY_PREFIX = 'elastic_models.hydration'
+
+# The (cache alias, key prefix) pairs hydrators in this process have read
+# instances through.
+_caches = set()
+
+
+def make_key(key_prefix, model, pk):
+    # Hashed, since memcached doesn't allow spaces or long keys.
+    key = "%s.%s/%s" % (model._meta.app_label, model._meta.model_name, pk)
+    return "%s:%s" % (key_prefix, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+def get_hydration_caches():
+    """
+    Returns the (cache alias, key prefix) pairs instances may be cached
+    under: the aliases in the ELASTICSEARCH_HYDRATION_CACHES setting, with
+    the default prefix, and those used by hydrators in this process.
+    """
+    aliases = getattr(settings, 'ELASTICSEARCH_HYDRATION_CACHES', ())
+    return _caches | set((alias, DEFAULT_KEY_PREFIX) for alias in aliases)
+
+def invalidate_instances(model, pks):
+    """
+    Removes the cached instances of model with the given primary keys, once
+    their rows have changed.
+    """
+    pks = list(pks)
+    if not pks:
+        return
+    for alias, key_prefix in get_hydration_caches():
+        caches[alias].delete_many([make_key(key_prefix, model, pk) for pk in pks])
+
+def invalidate_changed_instances(sender, pks, **kwargs):
+    """
+    Receives instances_changed, which the app config connects it to.
+    """
+    invalidate_instances(sender, pks)
+
+
+class Hydrator(object):
+    """
+    Loads the model instances for search hits, in the hits' (score) order,
+    with one query per model, even when the hits come from several indexes.
+
+    querysets maps models to the querysets to load them from (e.g. with
+    select_related or only); other models are loaded from their index's
+    get_hydration_queryset.  If cache is the alias of a cache in CACHES,
+    instances are read through it, and kept there for timeout seconds.
+
+    Cached instances are removed when their rows are saved or deleted
+    through the index updates (see invalidate_instances), by processes that
+    have used the cache, or list it in ELASTICSEARCH_HYDRATION_CACHES.
+
+    Hits whose rows no longer exist (or aren't in the queryset) are stale.
+    They are collected in stale, and left out of the results unless
+    keep_stale is True, in which case None takes their place.  If
+    delete_stale is True, the documents of those whose rows aren't in the
+    index's get_queryset either are deleted too.  Hits of unregistered
+    document types are treated as stale.
+    """
+    def __init__(self, querysets=None, cache=None, timeout=300,
+                 key_prefix=DEFAULT_KEY_PREFIX, keep_stale=False,
+                 delete_stale=False):
+        self.querysets = querysets or {}
+        self.cache = caches[cache] if cache is not None else None
+        if cache is not None:
+            _caches.add((cache, key_prefix))
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.keep_stale = keep_stale
+        self.delete_stale = delete_stale
+        self.stale = []
+
+    def get_index(self, hit):
+        if not hasattr(self, '_indexes'):
+            self._indexes = dict((index.get_doc_type(), index)
+                                 for index in index_registry.values())
+        return self._indexes.get(hit.meta.doc_type)
+
+    def get_queryset(self, index):
+        if index.model in self.querysets:
+            return self.querysets[index.model]
+        return index.get_hydration_queryset()
+
+    def make_key(self, model, pk):
+        return make_key(self.key_prefix, model, pk)
+
+    def load(self, qs, pks):
+        """
+        Returns a dictionary mapping the pks that exist in qs to their
+        instances.
+        """
+        instances = {}
+        if self.cache is not None:
+            keys = dict((self.make_key(qs.model, pk), pk) for pk in pks)
+            for key, instance in self.cache.get_many(list(keys)).items():
+                instances[keys[key]] = instance
+            pks = [pk for pk in pks if pk not in instances]
+
+        if pks:
+            loaded = dict((instance.pk, instance) for instance in qs.filter(pk__in=pks))
+            if self.cache is not None and loaded:
+                self.cache.set_many(dict((self.make_key(qs.model, pk), instance)
+                                         for pk, instance in loaded.items()),
+                                    self.timeout)
+            instances.update(loaded)
+        return instances
+
+    def delete_missing(self, index, pks):
+        """
+        Deletes the documents for the pks whose rows aren't in the index's
+        queryset.  Rows only left out of the hydration queryset are kept.
+        """
+        present = set(index.get_queryset().filter(pk__in=pks).values_list('pk', flat=True))
+        for pk in pks:
+            if pk not in present:
+                queue_delete(index, pk)
+
+    def hydrate(self, hits):
+        """
+        Returns the instances for hits, in the same order.
+        """
+        self.stale = []
+        entries = []
+        # Maps each model to its queryset and the pks to load from it.
+        pks = OrderedDict()
+        for hit in hits:
+            index = self.get_index(hit)
+            if index is None:
+                entries.append((None, None, hit))
+                continue
+            model = index.model
+            pk = model._meta.pk.to_python(hit.meta.id)
+            entries.append((index, pk, hit))
+            if model not in pks:
+                pks[model] = (self.get_queryset(index), [])
+            pks[model][1].append(pk)
+
+        instances = {}
+        for model, (qs, model_pks) in pks.items():
+            for pk, instance in self.load(qs, model_pks).items():
+                instances[model, pk] = instance
+
+        results = []
+        stale_pks = OrderedDict()
+        for index, pk, hit in entries:
+            instance = None
+            if index is not None:
+                instance = instances.get((index.model, pk))
+            if instance is None:
+                self.stale.append(hit)
+                if index is not None:
+                    stale_pks.setdefault(index, []).append(pk)
+                if not self.keep_stale:
+                    continue
+            results.append(instance)
+
+        if self.delete_stale:
+            for index, index_pks in stale_pks.items():
+                self.delete_missing(index, index_pks)
+
+        if self.stale:
+            logger.info("%d search hits had no instance: %s" % (
+                len(self.stale), ", ".join("%s/%s" % (h.meta.doc_type, h.meta.id)
+                                          for h in self.stale)))
+        return results
@@ -2,22 +2,62 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import logging
-import threading
+import re
+from datetime import datetime
 
 from django.conf import settings
 from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
 from django.utils import six
 
-from elasticsearch import Elasticsearch, NotFoundError, exceptions
-from elasticsearch.helpers import bulk
+from elasticsearch import NotFoundError, exceptions
+from elasticsearch.helpers import BulkIndexError, scan
 import elasticsearch_dsl as dsl
 
 from .fields import FieldMappingMixin, FieldMappingOptions
+from .dependencies import DependencyGraph
+from .queryplan import QueryPlan
+from .pipeline import IndexPipeline
+from .mappings import MappingDiff
+from .sender import BulkSender
+from .connections import get_es, get_cluster_version, reset_connections
+from .fingerprints import get_fingerprint_store, get_namespace
+from .resultcache import CachedSearch, invalidate_results
+from .search import IndexSearch
+from .utils import chunked, merge
 
 logger = logging.getLogger(__name__)
 
+# Applied to indexes while create_index loads them.
+BULK_LOAD_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0,
+}
+# elasticsearch's defaults, restored once loading is done if the index was
+# created without them, on clusters older than 5.0 (newer ones can reset a
+# setting to its default).
+DEFAULT_LIVE_SETTINGS = {
+    'refresh_interval': '1s',
+    'number_of_replicas': 1,
+}
+
+# Patches the sub-documents prepared from a dependency in the documents
+# matched by update_by_query.  See Index.get_fanout_body.
+FANOUT_SCRIPT = (
+    "def value = ctx._source[params.field];"
+    "def items = value instanceof List ? value : [value];"
+    "for (item in items) {"
+    "  if (item != null && item.pk == params.pk) { item.putAll(params.doc); }"
+    "}"
+)
+
 index_registry = {}
-_connection_cache = threading.local()
+
+# Maps each sender model to the indexes a save of it affects.  See
+# get_dispatch_entries.
+_dispatch_table = {}
+_dependency_graph = None
 
 class IndexOptions(FieldMappingOptions):
     def __init__(self, sources=[]):
@@ -27,6 +67,21 @@ class IndexOptions(FieldMappingOptions):
         self.connection = self.get_value(sources, 'connection', 'default')
         self.index_by = self.get_value(sources, 'index_by', 1000)
         self.date_field = self.get_value(sources, 'date_field', 'modified_on')
+        # Whether index_queryset fetches, prepares and sends chunks
+        # concurrently.  See IndexPipeline.
+        self.pipeline = self.get_value(sources, 'pipeline', False)
+        # The largest bulk request to send, in bytes.  See BulkSender.
+        self.bulk_max_bytes = self.get_value(sources, 'bulk_max_bytes', 10 * 1024 * 1024)
+        # The number of indexes created by create_generation to keep,
+        # including the live one.
+        self.generations = self.get_value(sources, 'generations', 2)
+        # Whether searches are cached by the ResultCache configured in the
+        # ELASTICSEARCH_RESULT_CACHE setting.
+        self.cache_results = self.get_value(sources, 'cache_results', False)
+        # The names of the model fields that get_queryset (and includes or
+        # should_index) read to decide whether an instance is indexed, or
+        # None if they aren't known.
+        self.queryset_fields = self.get_value(sources, 'queryset_fields', None)
 
         # A dictionary whose keys are other models that this model's index
         # depends on, and whose values are query set paramaters for this model
@@ -37,9 +92,26 @@ class IndexOptions(FieldMappingOptions):
         # BlogPost.objects.filter(author=instance) to be re-indexed.
         self.dependencies = self.get_value(sources, 'dependencies', {})
 
+        # A dictionary whose keys are dependencies that are copied into a
+        # field of this model's documents, and whose values are the names of
+        # those fields (ObjectFields or NestedObjectListFields).  When an
+        # instance of the key model changes, the copies are patched in place
+        # by an update_by_query, rather than by re-indexing every dependent
+        # instance.  For example, dependencies = {Author: 'author'} and
+        # denormalized = {Author: 'author'}, with author = ObjectField('author').
+        self.denormalized = self.get_value(sources, 'denormalized', {})
+        # update_by_query requests matching more documents than this run in
+        # the background on the cluster.
+        self.fanout_background_size = self.get_value(sources, 'fanout_background_size', 1000)
+
 
 class Index(FieldMappingMixin):
     _options_class = IndexOptions
+
+    # Subclasses can define includes(instance), which returns whether
+    # instance should be indexed without querying the database.  It must
+    # agree with get_queryset.
+    includes = None
     
     def contribute_to_class(self, model, name):
         self.model = model
@@ -47,6 +119,17 @@ class Index(FieldMappingMixin):
         setattr(model, name, self)
 
         index_registry[(model, name)] = self
+        build_dispatch_table()
+
+        if apps.ready:
+            # Indexes registered at startup are connected by the app config.
+            from .receivers import connect_delete_receivers
+            connect_delete_receivers([self])
+
+    def get_label(self):
+        return "%s.%s.%s" % (self.model._meta.app_label,
+                             self.model._meta.model_name,
+                             self.name)
 
     def get_index(self):
         index_name = settings.ELASTICSEARCH_CONNECTIONS[self._meta.connection]['INDEX_NAME']
@@ -59,25 +142,21 @@ class Index(FieldMappingMixin):
             return "%s_%s_%s" % (self.model._meta.app_label, self.model._meta.model_name, self.name)
 
     def get_dependencies(self):
-        dependencies = self._meta.dependencies
-        for model, query in dependencies.items():
-            if isinstance(model, six.string_types):
-                (app_name, model_name) = model.split('.')
-                model_cls = apps.get_model(app_name, model_name)
-                dependencies.pop(model)
-                dependencies[model_cls] = query
-        return dependencies
+        return _resolve_models(self._meta.dependencies)
+
+    def get_denormalized(self):
+        return _resolve_models(self._meta.denormalized)
 
     def get_es(self):
-        if not hasattr(_connection_cache, self._meta.connection):
-            hosts = settings.ELASTICSEARCH_CONNECTIONS[self._meta.connection]['HOSTS']
-            setattr(_connection_cache, self._meta.connection,
-                    Elasticsearch(hosts=hosts))
-        
-        return getattr(_connection_cache, self._meta.connection)
+        return get_es(self._meta.connection)
+
+    def get_bulk_sender(self):
+        return BulkSender(self.get_es(), max_docs=self._meta.index_by,
+                          max_bytes=self._meta.bulk_max_bytes)
 
     def get_search(self):
-        s = dsl.Search(using=self.get_es())
+        search_class = CachedSearch if self._meta.cache_results else IndexSearch
+        s = search_class(using=self.get_es(), connection=self._meta.connection)
         s = s.index(self.get_index())
         s = s.doc_type(self.get_doc_type())
         return s
@@ -88,18 +167,88 @@ class Index(FieldMappingMixin):
         self.add_fields_to_mapping(mapping)
         return mapping
     
-    def put_mapping(self):
+    def get_mapping_diff(self, index=None):
+        """
+        Returns a MappingDiff between this index's mapping and analysis
+        settings and the ones in the cluster, or None if the index doesn't
+        exist.
+        """
+        es = self.get_es()
+        index = index or self.get_index()
+        if not es.indices.exists(index):
+            return None
+
+        mapping = self.get_mapping()
+        doc_type = mapping.doc_type
+        analysis = merge([mapping._collect_analysis(),
+                          self.get_settings().get('analysis', {})], overwrite=True)
+
+        # The index may be an alias, so the responses are keyed by the name
+        # of the physical index.
+        live_mapping = {}
+        for data in es.indices.get_mapping(index=index, doc_type=doc_type).values():
+            live_mapping = data['mappings'].get(doc_type, {})
+        live_analysis = {}
+        for data in es.indices.get_settings(index=index).values():
+            live_analysis = data['settings'].get('index', {}).get('analysis', {})
+
+        return MappingDiff(mapping.to_dict()[doc_type], live_mapping,
+                           analysis, live_analysis)
+
+    def update_mapping(self, diff, index=None):
+        """
+        Applies the additions in a compatible MappingDiff to the index in
+        place.  Adding analysis settings closes the index briefly.
+        """
+        es = self.get_es()
+        index = index or self.get_index()
+        mapping = self.get_mapping()
+
+        if diff.added_analysis:
+            try:
+                logger.debug("Adding analysis settings to index '%s': %s" % (index, diff.added_analysis))
+                es.indices.close(index)
+                es.indices.put_settings({'analysis': diff.added_analysis}, index)
+            finally:
+                es.indices.open(index)
+
+        if diff.added_fields:
+            logger.debug("Adding fields to mapping '%s': %s" % (mapping.doc_type, diff.added_fields))
+            es.indices.put_mapping(index=index, doc_type=mapping.doc_type,
+                                   body=mapping.to_dict())
+
+    def put_mapping(self, index=None, force=False):
+        """
+        Creates the index and its mapping.  If the index already exists,
+        compatible changes are applied in place, and the index is only
+        deleted and recreated if the changes require it, or force is True.
+        Returns the MappingDiff against the existing index, if any.
+        """
         mapping = self.get_mapping()
         settings = self.get_settings()
         es = self.get_es()
         
         doc_type = mapping.doc_type
-        index = self.get_index()
+        index = index or self.get_index()
+        
+        diff = None if force else self.get_mapping_diff(index)
+        if diff is not None and diff.is_compatible:
+            if diff:
+                logger.debug("Updating index '%s' in place: %s" % (index, diff))
+                self.update_mapping(diff, index)
+            else:
+                logger.debug("Mapping for index '%s' is up to date" % (index))
+            return diff
         
+        if diff is not None:
+            logger.warning("Rebuilding index '%s' because of %s" % (index, diff))
         
         if es.indices.exists(index):
             logger.debug("Removing index '%s'" % (index))
             es.indices.delete(index)
+            invalidate_results([index])
+            if index == self.get_index():
+                self.forget_fingerprints()
         
         logger.debug("Creating index '%s' and mapping '%s'" % (index, doc_type))
         mapping.save(index, using=es)
@@ -113,35 +262,604 @@ class Index(FieldMappingMixin):
                 es.indices.open(index)
         else:
             logger.debug("Not settings to update for index '%s'" % (index))
+        
+        return diff
     
+    def get_generation_name(self):
+        return "%s_%s" % (self.get_index(), datetime.utcnow().strftime('%Y%m%d%H%M%S%f'))
+
+    def get_generations(self):
+        """
+        Returns the names of the indexes created by create_generation for
+        this index, oldest first.
+        """
+        alias = self.get_index()
+        pattern = re.compile(r"^%s_\d{20}$" % re.escape(alias))
+        names = self.get_es().indices.get_settings(index="%s_*" % alias).keys()
+        return sorted(n for n in names if pattern.match(n))
+
+    def get_live_generations(self):
+        """
+        Returns the names of the indexes that the alias returned by
+        get_index currently points to.
+        """
+        es = self.get_es()
+        alias = self.get_index()
+        if not es.indices.exists_alias(name=alias):
+            return []
+        return sorted(es.indices.get_alias(name=alias).keys())
+
+    def create_generation(self):
+        """
+        Creates a new physical index with this index's mapping, tuned for bulk
+        loading, and returns its name.  Load it with index_queryset, then
+        make it live with activate_generation.  The settings it was created
+        with (from get_settings or the cluster's templates) are kept in its
+        mapping's _meta, to be restored by activate_generation.
+        """
+        es = self.get_es()
+        doc_type = self.get_doc_type()
+        name = self.get_generation_name()
+        self.put_mapping(index=name)
+
+        created = es.indices.get_settings(index=name)[name]['settings'].get('index', {})
+        live_settings = dict((key, created.get(key)) for key in BULK_LOAD_SETTINGS)
+        es.indices.put_mapping(index=name, doc_type=doc_type,
+                               body={doc_type: {'_meta': {'live_settings': live_settings}}})
+
+        logger.debug("Applying bulk load settings to index '%s'" % name)
+        es.indices.put_settings(index=name, body={'index': BULK_LOAD_SETTINGS})
+        return name
+
+    def get_live_settings(self, name):
+        """
+        Returns the settings to restore on a generation created by
+        create_generation once it's loaded.
+        """
+        es = self.get_es()
+        doc_type = self.get_doc_type()
+        mapping = es.indices.get_mapping(index=name, doc_type=doc_type)
+        meta = mapping[name]['mappings'].get(doc_type, {}).get('_meta', {})
+        # Generations created without the record get the defaults.
+        live_settings = dict((key, None) for key in BULK_LOAD_SETTINGS)
+        live_settings.update(meta.get('live_settings', {}))
+
+        if get_cluster_version(self._meta.connection) < (5, 0):
+            for key, value in live_settings.items():
+                if value is None:
+                    live_settings[key] = DEFAULT_LIVE_SETTINGS[key]
+        return live_settings
+
+    def activate_generation(self, name):
+        """
+        Restores the settings a generation created by create_generation had
+        before bulk loading, atomically points the alias returned by
+        get_index at it, and removes old generations.
+        """
+        es = self.get_es()
+        alias = self.get_index()
+        live = self.get_live_generations()
+
+        restore = self.get_live_settings(name)
+        logger.debug("Restoring settings for index '%s': %s" % (name, restore))
+        es.indices.put_settings(index=name, body={'index': restore})
+        es.indices.refresh(index=name)
+        es.cluster.health(index=name, wait_for_status='yellow')
+
+        if not live and es.indices.exists(index=alias):
+            # A physical index created before generations were used has to
+            # be removed before the alias can take its name.
+            logger.warning("Removing index '%s' to replace it with an alias" % alias)
+            es.indices.delete(index=alias)
+
+        actions = [{'remove': {'index': l, 'alias': alias}} for l in live]
+        actions.append({'add': {'index': name, 'alias': alias}})
+        logger.debug("Pointing alias '%s' at index '%s'" % (alias, name))
+        es.indices.update_aliases(body={'actions': actions})
+        invalidate_results([alias])
+        self.forget_fingerprints()
+
+        self.remove_old_generations()
+
+    def remove_old_generations(self):
+        """
+        Deletes the oldest generations, keeping the number given by the
+        generations Meta option.  Live generations are never deleted.
+        """
+        es = self.get_es()
+        live = self.get_live_generations()
+        generations = self.get_generations()
+
+        for name in generations[:max(len(generations) - self._meta.generations, 0)]:
+            if name not in live:
+                logger.debug("Removing old index '%s'" % name)
+                es.indices.delete(index=name)
+
+    def get_fingerprint_namespace(self):
+        return get_namespace(self.get_index(), self.get_doc_type())
+
+    def get_changed_documents(self, instances):
+        """
+        Returns (pk, document, fingerprint) tuples for the instances whose
+        documents differ from the last ones sent to the live index, according
+        to the fingerprint store (see get_fingerprint_store).  Without a
+        store, all of the instances are returned, with no fingerprint.
+        """
+        documents = [(instance.pk, self.prepare(instance)) for instance in instances]
+        store = get_fingerprint_store()
+        if store is None:
+            return [(pk, document, None) for pk, document in documents]
+        return store.get_changed(self.get_fingerprint_namespace(), documents)
+
+    def forget_fingerprints(self, pks=None):
+        """
+        Discards the stored fingerprints of the given pks, or all of them, so
+        the documents are sent next time they are indexed.
+        """
+        store = get_fingerprint_store()
+        if store is None:
+            return
+        if pks is None:
+            store.invalidate(self.get_fingerprint_namespace())
+        else:
+            store.delete_many(self.get_fingerprint_namespace(), pks)
+
     def index_instance(self, instance):
-        self.get_es().index(
-            index=self.get_index(),
-            doc_type=self.get_doc_type(),
-            id=instance.pk,
-            body=self.prepare(instance)
-        )
-
-    def index_queryset(self, qs):
+        for pk, document, fingerprint in self.get_changed_documents([instance]):
+            self.get_es().index(
+                index=self.get_index(),
+                doc_type=self.get_doc_type(),
+                id=pk,
+                body=document
+            )
+            invalidate_results([self.get_index()])
+            if fingerprint is not None:
+                get_fingerprint_store().set_many(self.get_fingerprint_namespace(),
+                                                 {pk: fingerprint})
+
+    def aindex_instance(self, instance):
+        """
+        Returns a coroutine that indexes instance without blocking the event
+        loop.  See elastic_models.aio.
+        """
+        from .aio import aindex_instance
+        return aindex_instance(self, instance)
+
+    def get_fanout_body(self, name, instance):
+        """
+        Returns the body of an update_by_query request that copies instance
+        into the sub-documents of the field called name that were prepared
+        from it.
+        """
+        field = self.fields[name]
+        query = {'term': {'%s.pk' % name: instance.pk}}
+        if issubclass(field.dsl_field, dsl.Nested):
+            query = {'nested': {'path': name, 'query': query}}
+
+        return {
+            'query': query,
+            'script': {
+                'lang': 'painless',
+                'inline': FANOUT_SCRIPT,
+                'params': {'field': name, 'pk': instance.pk, 'doc': field.prepare(instance)},
+            },
+        }
+
+    def can_update_by_query(self):
+        """
+        Returns whether this index's cluster can run the update_by_query
+        requests sent by fanout, which need elasticsearch 5.0 or later.
+        """
+        return get_cluster_version(self._meta.connection) >= (5, 0)
+
+    def get_copy_pks(self, name, instance):
+        """
+        Returns the set of primary keys of the documents holding a copy of
+        instance in the field called name.
+        """
+        query = self.get_fanout_body(name, instance)['query']
+        hits = scan(self.get_es(), index=self.get_index(), doc_type=self.get_doc_type(),
+                    query={'query': query, '_source': False})
+        return set(self.model._meta.pk.to_python(hit['_id']) for hit in hits)
+
+    def fanout(self, name, instance):
+        """
+        Brings the copies of instance in the field called name of this
+        index's documents up to date.  The documents that still depend on
+        instance are patched with an update_by_query on the cluster, which
+        runs in the background if they are more than the
+        fanout_background_size Meta option.  Documents that gained or lost
+        the copy (when a foreign key changed, say) are re-indexed instead, and
+        so are all of them on clusters older than 5.0.
+        """
+        from .receivers import get_dependent_pks
+
+        es = self.get_es()
         index = self.get_index()
         doc_type = self.get_doc_type()
 
-        actions = (
-            {
+        paths = [entry_paths for entry_index, own, entry_paths
+                 in get_dispatch_entries(type(instance)) if entry_index is self][0]
+        dependents = set(get_dependent_pks(self, paths, [instance.pk]))
+        copies = self.get_copy_pks(name, instance)
+
+        patched = set()
+        if self.can_update_by_query():
+            patched = copies & dependents
+        reindexed = (copies | dependents) - patched
+
+        if patched:
+            background = len(patched) > self._meta.fanout_background_size
+            logger.debug("Updating %d documents in '%s' with %s %s%s" % (
+                len(patched), index, instance._meta.model_name, instance.pk,
+                " in the background" if background else ""))
+            es.transport.perform_request(
+                'POST', '/%s/%s/_update_by_query' % (index, doc_type),
+                params={'conflicts': 'proceed',
+                        'wait_for_completion': 'false' if background else 'true'},
+                body=self.get_fanout_body(name, instance))
+            # The stored fingerprints of the patched documents are out of date.
+            self.forget_fingerprints(patched)
+            invalidate_results([index])
+
+        if reindexed:
+            # Sent after the update_by_query, whose conflicts are skipped, so
+            # it can't overwrite them.
+            sender = self.get_bulk_sender()
+            for chunk in chunked(sorted(reindexed), self._meta.index_by):
+                sender.send(self.get_pk_actions(chunk))
+
+    def get_query_plan(self):
+        paths, complete = self.get_field_paths()
+        plan = QueryPlan(self.model, paths, restrict_columns=complete)
+
+        if not complete:
+            # Fields we can't inspect, like templates, are likely to read the
+            # models we depend on.
+            graph = get_dependency_graph()
+            for model, path in graph.get_dependencies(self):
+                plan.add_path(path.split('__'), reads_columns=False)
+
+        return plan
+
+    @property
+    def query_plan(self):
+        if not hasattr(self, '_em_query_plan'):
+            self._em_query_plan = self.get_query_plan()
+        return self._em_query_plan
+
+    def get_chunks(self, qs, start_after=None, done=0):
+        """
+        Yields lists of at most index_by instances from qs in primary key
+        order, starting after the primary key start_after.  Each chunk is a
+        separate query selecting the rows after the previous chunk, so no
+        cursor is held open between chunks.
+
+        If qs is sliced, the slice is applied to the primary key order, and
+        done is the number of instances of the slice already indexed.
+        """
+        qs, offset_pk, limit = _split_limits(qs)
+        if start_after is None:
+            start_after = offset_pk
+        if limit is not None:
+            limit -= done
+
+        plan = self.query_plan
+        qs = plan.apply(qs.order_by('pk'))
+
+        while limit is None or limit > 0:
+            size = self._meta.index_by
+            if limit is not None:
+                size = min(size, limit)
+                limit -= size
+
+            chunk_qs = qs
+            if start_after is not None:
+                chunk_qs = qs.filter(pk__gt=start_after)
+
+            instances = list(chunk_qs[:size])
+            if not instances:
+                break
+
+            plan.prefetch(instances)
+            yield instances
+
+            if len(instances) < size:
+                break
+            start_after = instances[-1].pk
+
+    def get_modified_chunks(self, qs, after=None, limit=None):
+        """
+        Yields lists of at most index_by instances from qs in (date_field,
+        pk) order, starting after the (date, pk) pair after.  Rows sharing a
+        date are ordered by pk, so none are skipped when a chunk ends among
+        them.  Rows without a date are never included.
+        """
+        date_field = self._meta.date_field
+        plan = self.query_plan
+        qs = qs.filter(**{'%s__isnull' % date_field: False})
+        qs = plan.apply(qs.order_by(date_field, 'pk'))
+
+        while limit is None or limit > 0:
+            size = self._meta.index_by
+            if limit is not None:
+                size = min(size, limit)
+                limit -= size
+
+            chunk_qs = qs
+            if after is not None:
+                date, pk = after
+                chunk_qs = qs.filter(Q(**{'%s__gt' % date_field: date}) |
+                                     Q(**{date_field: date, 'pk__gt': pk}))
+
+            instances = list(chunk_qs[:size])
+            if not instances:
+                break
+
+            plan.prefetch(instances)
+            yield instances
+
+            if len(instances) < size:
+                break
+            after = (getattr(instances[-1], date_field), instances[-1].pk)
+
+    def get_instance_actions(self, instances, index_name=None):
+        index = index_name or self.get_index()
+        doc_type = self.get_doc_type()
+
+        if index_name is not None:
+            # Generations start out empty, so only the live index can
+            # already hold a document.
+            for instance in instances:
+                yield {
+                    '_index': index,
+                    '_type': doc_type,
+                    '_id': instance.pk,
+                    '_source': self.prepare(instance),
+                }
+            return
+
+        for pk, document, fingerprint in self.get_changed_documents(instances):
+            action = {
+                '_index': index,
+                '_type': doc_type,
+                '_id': pk,
+                '_source': document,
+            }
+            if fingerprint is not None:
+                # Stored by the BulkSender once the document is indexed.
+                action['_fingerprint'] = fingerprint
+            yield action
+
+    def get_affected_fields(self, update_fields):
+        """
+        Returns the names of the fields whose values may change when the
+        given model fields are saved (as in post_save's update_fields), or
+        None if that can't be determined for some field.
+        """
+        update_fields = frozenset(update_fields)
+        cache = self.__dict__.setdefault('_em_affected_fields', {})
+        if update_fields in cache:
+            return cache[update_fields]
+
+        opts = self.model._meta
+        saved = set()
+        for name in update_fields:
+            field = opts.get_field(name)
+            saved.update([field.name, field.attname])
+
+        affected = set()
+        for name, field in self.fields.items():
+            paths = field.get_paths()
+            if paths is None:
+                affected = None
+                break
+            if any(self.reads_saved_field(path[0], saved) for path in paths):
+                affected.add(name)
+
+        cache[update_fields] = affected
+        return affected
+
+    def membership_may_change(self, update_fields):
+        """
+        Returns whether saving the given model fields may change whether an
+        instance belongs in the index.
+        """
+        overridden = [name for name in ('get_queryset', 'should_index')
+                      if six.get_unbound_function(getattr(type(self), name)) is not
+                      six.get_unbound_function(getattr(Index, name))]
+        if not overridden and self.includes is None:
+            return False
+        if self._meta.queryset_fields is None:
+            return True
+
+        opts = self.model._meta
+        saved = set()
+        for name in update_fields:
+            field = opts.get_field(name)
+            saved.update([field.name, field.attname])
+        return any(name in saved for name in self._meta.queryset_fields)
+
+    def reads_saved_field(self, attr, saved):
+        opts = self.model._meta
+        if attr == 'pk':
+            field = opts.pk
+        else:
+            try:
+                field = opts.get_field(attr)
+            except FieldDoesNotExist:
+                # A method or property, which could read anything.
+                return True
+
+        if field.concrete:
+            return field.name in saved or field.attname in saved
+        # Reverse and many to many relations aren't changed by saving.  Other
+        # virtual fields (like generic foreign keys) may read any column.
+        return not (field.auto_created or field.many_to_many)
+
+    def prepare_fields(self, instance, names):
+        """
+        Prepares only the named fields of instance's document.
+        """
+        return self.get_serializer(self.model, frozenset(names))(instance)
+
+    def get_update_actions(self, qs, names, index_name=None):
+        """
+        Yields bulk actions that update the named fields of the documents
+        for qs, leaving the rest of each document as it is.
+        """
+        for instances in self.get_chunks(qs):
+            for action in self.get_instance_update_actions(instances, names, index_name):
+                yield action
+
+    def get_instance_update_actions(self, instances, names, index_name=None):
+        index = index_name or self.get_index()
+        doc_type = self.get_doc_type()
+
+        # The stored fingerprints are for the documents as a whole.
+        self.forget_fingerprints([instance.pk for instance in instances])
+        for instance in instances:
+            yield {
+                '_op_type': 'update',
                 '_index': index,
                 '_type': doc_type,
                 '_id': instance.pk,
-                '_source': self.prepare(instance),
+                'doc': self.prepare_fields(instance, names),
+            }
+
+    def get_pk_actions(self, pks, names=None, index_name=None):
+        """
+        Yields bulk actions that bring the documents for pks up to date.
+        Instances that should be indexed are reloaded and indexed (or if
+        names is given, the named fields are updated), and the documents of
+        the rest are deleted.  Whether they should be indexed is checked in
+        bulk, by their presence in get_queryset and with is_included.
+        """
+        indexed = set()
+        qs = self.get_queryset().filter(pk__in=pks)
+        for instances in self.get_chunks(qs):
+            instances = [i for i in instances if self.is_included(i) is not False]
+            indexed.update(instance.pk for instance in instances)
+            if names is None:
+                actions = self.get_instance_actions(instances, index_name)
+            else:
+                actions = self.get_instance_update_actions(instances, names, index_name)
+            for action in actions:
+                yield action
+
+        excluded = [pk for pk in pks if pk not in indexed]
+        for action in self.get_delete_actions(excluded, index_name):
+            yield action
+
+    def get_delete_actions(self, pks, index_name=None):
+        """
+        Yields bulk actions that delete the documents for pks.
+        """
+        index = index_name or self.get_index()
+        doc_type = self.get_doc_type()
+
+        self.forget_fingerprints(pks)
+        for pk in pks:
+            yield {
+                '_op_type': 'delete',
+                '_index': index,
+                '_type': doc_type,
+                '_id': pk,
             }
-            for instance in qs.iterator()
-        )
 
-        return bulk(client = self.get_es(), actions=actions)
+    def get_index_actions(self, qs, index_name=None):
+        for instances in self.get_chunks(qs):
+            for action in self.get_instance_actions(instances, index_name):
+                yield action
+
+    def index_queryset(self, qs, checkpoint=None, pipeline=None, index_name=None):
+        """
+        Indexes the instances in qs, sending a bulk request per chunk.  If a
+        Checkpoint is given, indexing resumes after the last chunk recorded in
+        it, and each chunk is recorded once it has been sent.
+
+        If pipeline is True (by default, the pipeline Meta option), the chunks
+        are fetched, prepared and sent concurrently by an IndexPipeline.
+
+        Documents are written to index_name if given, rather than the live
+        index (see create_generation).
+        """
+        if pipeline is None:
+            pipeline = self._meta.pipeline
+        if pipeline:
+            return IndexPipeline(self).run(qs, checkpoint=checkpoint,
+                                           index_name=index_name)
+
+        sender = self.get_bulk_sender()
+        if checkpoint is None:
+            return sender.send(self.get_index_actions(qs, index_name))
+
+        success = 0
+        errors = []
+        failed = []
+        chunks = self.get_chunks(qs, start_after=checkpoint.last_pk,
+                                 done=checkpoint.count)
+        for instances in chunks:
+            try:
+                chunk_success, chunk_errors = sender.send(
+                    self.get_instance_actions(instances, index_name))
+            except BulkIndexError as e:
+                # As without a checkpoint, the other chunks are still sent.
+                chunk_success, chunk_errors = len(instances) - len(e.errors), e.errors
+                failed.extend(e.errors)
+            success += chunk_success
+            errors.extend(chunk_errors)
+            checkpoint.update(instances[-1].pk, len(instances))
+
+        if failed:
+            raise BulkIndexError('%i document(s) failed to index.' % len(failed), failed)
+        return success, errors
+
+    def index_modified(self, qs, checkpoint, limit=None):
+        """
+        Indexes the instances in qs modified since the last call with the
+        same Checkpoint, and at most limit of them.  The checkpoint records
+        the date_field value (in extra['date']) and pk of the last instance
+        indexed, and is updated after each chunk is sent.
+        """
+        field = self.model._meta.get_field(self._meta.date_field)
+        after = None
+        if checkpoint.last_pk is not None and 'date' in checkpoint.extra:
+            after = (field.to_python(checkpoint.extra['date']), checkpoint.last_pk)
+
+        sender = self.get_bulk_sender()
+        success = 0
+        errors = []
+        for instances in self.get_modified_chunks(qs, after=after, limit=limit):
+            chunk_success, chunk_errors = sender.send(self.get_instance_actions(instances))
+            success += chunk_success
+            errors.extend(chunk_errors)
+
+            last = instances[-1]
+            checkpoint.extra['date'] = getattr(last, self._meta.date_field).isoformat()
+            checkpoint.update(last.pk, len(instances))
+
+        return success, errors
+
+    def aindex_queryset(self, qs):
+        """
+        Returns a coroutine that indexes the instances in qs without blocking
+        the event loop, and returns the number indexed.
+        """
+        from .aio import aindex_queryset
+        return aindex_queryset(self, qs)
 
     def get_queryset(self):
         #Some objects have a default ordering, which only slows things down here.
         return self.model.objects.order_by()
 
+    def get_hydration_queryset(self):
+        """
+        Returns the queryset that a Hydrator loads this index's search hits
+        from.  Override it to add select_related or only, for example.
+        """
+        return self.model._default_manager.all()
+
     def get_filtered_queryset(self, since=None, until=None, limit=None):
         qs = self.get_queryset()
         filters = {}
@@ -159,7 +877,24 @@ class Index(FieldMappingMixin):
         return qs
     
     def should_index(self, instance):
+        if self.includes is not None:
+            return self.includes(instance)
         return self.get_queryset().filter(pk=instance.pk).exists()
+
+    def is_included(self, instance):
+        """
+        Returns whether instance should be indexed, if that can be decided
+        from the instance itself: with should_index if a subclass overrides
+        it, or else with includes.  Otherwise returns None, and the instance
+        is checked along with others, with a single query, when its update
+        is sent.
+        """
+        if six.get_unbound_function(type(self).should_index) is not \
+                six.get_unbound_function(Index.should_index):
+            return self.should_index(instance)
+        if self.includes is not None:
+            return self.includes(instance)
+        return None
     
     def __getattr__(self, attr):
         try:
@@ -167,3 +902,113 @@ class Index(FieldMappingMixin):
         except AttributeError:
             #Generate an exception message that refers to self
             return super(Index, self).__getattribute__(attr)
+
+    def __getitem__(self, key):
+        # Special methods aren't looked up through __getattr__.
+        return self.get_search()[key]
+
+
+def _resolve_models(options):
+    """
+    Returns a copy of a dictionary keyed by models or 'app_label.ModelName'
+    strings, keyed by models.
+    """
+    resolved = {}
+    for model, value in options.items():
+        if isinstance(model, six.string_types):
+            (app_name, model_name) = model.split('.')
+            model = apps.get_model(app_name, model_name)
+        resolved[model] = value
+    return resolved
+
+def get_index_by_label(label):
+    for index in index_registry.values():
+        if index.get_label() == label:
+            return index
+    raise LookupError("No index with label '%s'" % label)
+
+def _split_limits(qs):
+    """
+    Returns an unsliced copy of qs, along with the primary key preceding the
+    slice's first row (in primary key order) and the slice's length.
+
+    Rows are indexed in primary key order, so a ValueError is raised for a
+    slice of qs in any other order.
+    """
+    query = qs.query
+    if query.low_mark == 0 and query.high_mark is None:
+        return qs, None, None
+
+    ordering = query.extra_order_by or query.order_by
+    if not ordering and query.default_ordering:
+        ordering = qs.model._meta.ordering
+    pk = qs.model._meta.pk
+    if list(ordering) not in ([], ['pk'], [pk.name], [pk.attname]):
+        raise ValueError("Only slices in primary key order can be indexed, not %s."
+                         % ", ".join(ordering))
+
+    low, high = query.low_mark, query.high_mark
+    qs = qs._clone()
+    qs.query.clear_limits()
+
+    offset_pk = None
+    if low:
+        pks = list(qs.order_by('pk').values_list('pk', flat=True)[low - 1:low])
+        if not pks:
+            # The slice starts past the last row.
+            return qs.none(), None, 0
+        offset_pk = pks[0]
+
+    limit = None if high is None else high - low
+    return qs, offset_pk, limit
+
+def get_dependency_graph():
+    """
+    Returns the DependencyGraph of the registered indexes, resolving their
+    dependencies the first time it is called after an index is registered.
+    """
+    global _dependency_graph
+    if _dependency_graph is None:
+        _dependency_graph = DependencyGraph(index_registry.values())
+    return _dependency_graph
+
+def _get_dispatch_entries(sender):
+    dependents = dict(get_dependency_graph().get_dependents(sender))
+
+    entries = []
+    for index in index_registry.values():
+        own = issubclass(sender, index.model)
+        paths = dependents.get(index, ())
+        if own or paths:
+            entries.append((index, own, paths))
+    return entries
+
+def get_dispatch_entries(sender):
+    """
+    Returns a list of (index, own, paths) tuples for the indexes affected by
+    saving an instance of sender.  own is True when sender is (a subclass of)
+    the index's model, and paths are the lookups selecting the instances that
+    depend on the saved one (see DependencyGraph.get_dependents).
+    """
+    try:
+        return _dispatch_table[sender]
+    except KeyError:
+        # Models that were not registered when the table was built.
+        entries = _dispatch_table[sender] = _get_dispatch_entries(sender)
+        return entries
+
+def build_dispatch_table():
+    global _dependency_graph
+    _dispatch_table.clear()
+    _dependency_graph = None
+    # Query plans include paths from the dependency graph.
+    for index in index_registry.values():
+        vars(index).pop('_em_query_plan', None)
+
+    # Dependencies can't be resolved until the app registry is ready, so the
+    # table is built lazily until then.
+    if not apps.ready:
+        return
+
+    for model in apps.get_models(include_auto_created=True):
+        _dispatch_table[model] = _get_dispatch_entries(model)
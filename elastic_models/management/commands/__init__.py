@@ -2,9 +2,14 @@ from optparse import make_option
 from datetime import datetime, timedelta
 import re
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 
 from elastic_models.indexes import index_registry
+from elastic_models.checkpoints import Checkpoint
+from elastic_models.fingerprints import get_fingerprint_store
+from elastic_models.parallel import index_in_parallel
 
 class IndexCommand(BaseCommand):
     option_list = BaseCommand.option_list + (
@@ -12,6 +17,12 @@ class IndexCommand(BaseCommand):
             help='Index data updated after this time.  yyyy-mm-dd[-hh:mm] or [#d][#h][#m][#s]'),
         make_option('--limit', action="store", default='', dest='limit',
             help='Index at most this many of each model.'),
+        make_option('--resume', action="store_true", default=False, dest='resume',
+            help='Continue an interrupted run from its last checkpoint.'),
+        make_option('--workers', action="store", default='1', dest='workers',
+            help='Index each model using this many processes.'),
+        make_option('--pipeline', action="store_true", default=None, dest='pipeline',
+            help='Fetch, prepare and send documents concurrently.'),
     )
     args = '<app[.model] app[.model] ...>'
     help = 'Creates and populates the search index.  If it already exists, it is deleted first.'
@@ -24,22 +35,26 @@ class IndexCommand(BaseCommand):
         flags=re.IGNORECASE)
 
     def parse_date_time(self, input):
-        try:
-            return datetime.strptime(input, "%Y-%m-%d-%H:%M")
-        except ValueError:
-            pass
-
-        try:
-            return datetime.strptime(input, "%Y-%m-%d")
-        except ValueError:
-            pass
+        """
+        Parses a date and time (in the current time zone) or a duration
+        before now.  The result is aware if USE_TZ is True.
+        """
+        for format in ("%Y-%m-%d-%H:%M", "%Y-%m-%d"):
+            try:
+                value = datetime.strptime(input, format)
+            except ValueError:
+                continue
+            if settings.USE_TZ:
+                value = timezone.make_aware(value, timezone.get_current_timezone())
+            return value
 
         match = self.duration_re.match(input)
         if match:
             kwargs = dict((k, int(v)) for (k, v) in match.groupdict().items() if v is not None)
-            return datetime.now() - timedelta(**kwargs)
+            # Subtracted from an aware time in UTC, so it spans DST changes.
+            return timezone.now() - timedelta(**kwargs)
 
-        raise ValueError("%s could not be interpereted as a datetime" % options['since'])
+        raise ValueError("%s could not be interpereted as a datetime" % input)
 
     def get_indexes(self, args):
         indexes = index_registry.values()
@@ -52,3 +67,32 @@ class IndexCommand(BaseCommand):
                                       i.name) in args]
 
         return indexes
+
+    def get_checkpoint(self, index, resume):
+        """
+        Returns the checkpoint recording this command's progress on index.
+        Unless resuming, any progress from a previous run is discarded.
+        """
+        checkpoint = Checkpoint("%s.%s" % (self.checkpoint_name, index.get_label()),
+                                model=index.model)
+        if not resume:
+            checkpoint.clear()
+        return checkpoint
+
+    def index_queryset(self, index, qs, checkpoint, options, index_name=None):
+        store = get_fingerprint_store()
+        hits = store.hits if store is not None else 0
+
+        workers = int(options['workers'])
+        if workers > 1:
+            success, errors = index_in_parallel(index, qs, workers, checkpoint=checkpoint,
+                                                pipeline=options['pipeline'],
+                                                index_name=index_name)
+        else:
+            success, errors = index.index_queryset(qs, checkpoint=checkpoint,
+                                                   pipeline=options['pipeline'],
+                                                   index_name=index_name)
+
+        print("Indexed %d %s objects, %d errors" % (success, index.model.__name__, len(errors)))
+        if store is not None and workers <= 1:
+            print("Skipped %d unchanged %s objects" % (store.hits - hits, index.model.__name__))
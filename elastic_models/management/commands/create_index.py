@@ -1,8 +1,22 @@
 from __future__ import print_function
 
+from optparse import make_option
+
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
 from elastic_models.management.commands import IndexCommand
+from elastic_models.reconcile import Reconciliation
 
 class Command(IndexCommand):
+    option_list = IndexCommand.option_list + (
+        make_option('--if-changed', action="store_true", default=False, dest='if_changed',
+            help='Only rebuild indexes whose mapping changed incompatibly.  Compatible '
+                 'changes are applied in place and the data re-indexed.'),
+    )
+    checkpoint_name = 'create_index'
+
     def handle(self, *args, **options):
         indexes = self.get_indexes(args)
 
@@ -16,7 +30,82 @@ class Command(IndexCommand):
 
         for index in indexes:
             qs = index.get_filtered_queryset(since=since, limit=limit)
-            print("Creating mapping for %s.%s" % (index.model.__name__, index.name))
-            index.put_mapping()
+            checkpoint = self.get_checkpoint(index, options['resume'])
+            if not checkpoint.exists() and options['if_changed']:
+                if self.update_in_place(index, qs, options):
+                    continue
+
+            if not checkpoint.exists():
+                print("Creating mapping for %s.%s" % (index.model.__name__, index.name))
+                checkpoint.extra = {
+                    'index_name': index.create_generation(),
+                    'started': now().isoformat(),
+                }
+                checkpoint.save()
+                print("Indexing %d %s objects" % (qs.count(), index.model.__name__))
+            else:
+                print("Resuming %s.%s after %d objects" % (index.model.__name__, index.name, checkpoint.count))
+
+            index_name = checkpoint.extra['index_name']
+            self.index_queryset(index, qs, checkpoint, options, index_name=index_name)
+            caught_up = now()
+            self.catch_up(index, parse_datetime(checkpoint.extra['started']), index_name)
+            # Rows deleted during the load are still in the new index.  Rows
+            # left out by --since or --limit stay out.
+            self.remove_orphans(index, index_name, index_missing=not (since or limit))
+
+            print("Switching %s.%s to the new index" % (index.model.__name__, index.name))
+            index.activate_generation(index_name)
+            # Changes saved since the first pass went to the old index.
+            self.catch_up(index, caught_up, index_name)
+            checkpoint.clear()
+
+    def update_in_place(self, index, qs, options):
+        """
+        Applies compatible mapping changes to the live index.  Returns False
+        if the index has to be rebuilt instead.
+        """
+        diff = index.get_mapping_diff()
+        if diff is None:
+            return False
+
+        if not diff:
+            print("Mapping for %s.%s is up to date" % (index.model.__name__, index.name))
+            return True
+
+        if not diff.is_compatible:
+            print("Rebuilding %s.%s because of %s" % (index.model.__name__, index.name, diff))
+            return False
+
+        print("Updating mapping for %s.%s in place: %s" % (index.model.__name__, index.name, diff))
+        index.update_mapping(diff)
+        if diff.added_fields:
             print("Indexing %d %s objects" % (qs.count(), index.model.__name__))
-            index.index_queryset(qs)
+            self.index_queryset(index, qs, None, options)
+        return True
+
+    def catch_up(self, index, started, index_name):
+        """
+        Indexes the changes saved to the live index while the new one was
+        being loaded.
+        """
+        try:
+            index.model._meta.get_field(index._meta.date_field)
+        except FieldDoesNotExist:
+            print("%s has no '%s' field, so changes made while indexing may be missing"
+                  % (index.model.__name__, index._meta.date_field))
+            return
+
+        qs = index.get_filtered_queryset(since=started)
+        index.index_queryset(qs, index_name=index_name)
+
+    def remove_orphans(self, index, index_name, index_missing=True):
+        """
+        Deletes the documents in the new index whose rows no longer exist.
+        """
+        reconciliation = Reconciliation(index, index_missing=index_missing,
+                                        index_name=index_name)
+        counts = reconciliation.run()
+        if counts['orphan']:
+            print("Deleted %d documents for %s objects deleted while indexing"
+                  % (counts['orphan'], index.model.__name__))
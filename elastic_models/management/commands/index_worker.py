@@ -0,0 +1,39 @@
+from __future__ import print_function
+
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from elastic_models.outbox import process_batch
+from elastic_models.utils import close_db_connections
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action="store", default='500', dest='batch_size',
+            help='Claim at most this many outbox entries at a time.'),
+        make_option('--interval', action="store", default='1', dest='interval',
+            help='Seconds to wait before checking an empty outbox again.'),
+        make_option('--once', action="store_true", default=False, dest='once',
+            help='Exit once the outbox is empty.'),
+        make_option('--database', action="store", default=DEFAULT_DB_ALIAS, dest='database',
+            help='The database holding the outbox.'),
+    )
+    help = 'Sends the index updates recorded in the outbox to elasticsearch.  Several workers can run at once.'
+
+    def handle(self, *args, **options):
+        batch_size = int(options['batch_size'])
+        interval = float(options['interval'])
+
+        while True:
+            count = process_batch(batch_size, using=options['database'])
+            if count:
+                print("Processed %d outbox entries" % count)
+                continue
+
+            if options['once']:
+                break
+            # Don't hold a connection open while idle.
+            close_db_connections()
+            time.sleep(interval)
@@ -0,0 +1,33 @@
+from __future__ import print_function
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from elastic_models.management.commands import IndexCommand
+from elastic_models.reconcile import Reconciliation
+
+class Command(IndexCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action="store_true", default=False, dest='dry_run',
+            help='Report the differences without fixing them.'),
+    )
+    help = 'Deletes documents whose rows no longer exist (or are no longer indexed), and indexes rows without a document.'
+
+    def handle(self, *args, **options):
+        for index in self.get_indexes(args):
+            reconciliation = Reconciliation(index, dry_run=options['dry_run'])
+            counts = reconciliation.run()
+
+            label = "%s.%s" % (index.model.__name__, index.name)
+            if options['dry_run']:
+                print("%s: %d orphaned documents, %d missing documents"
+                      % (label, counts['orphan'], counts['missing']))
+                for kind in ('orphan', 'missing'):
+                    sample = reconciliation.samples[kind]
+                    if sample:
+                        more = ", ..." if counts[kind] > len(sample) else ""
+                        print("  %s: %s%s" % (kind, ", ".join(str(pk) for pk in sample), more))
+            else:
+                print("%s: deleted %d orphaned documents, indexed %d missing documents, %d errors"
+                      % (label, counts['orphan'], counts['missing'], len(reconciliation.errors)))
@@ -0,0 +1,40 @@
+from __future__ import print_function
+
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from elastic_models.indexes import get_es
+from elastic_models.sender import BulkSender, get_dead_letter_path, read_dead_letters
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--connection', action="store", default='default', dest='connection',
+            help='The ELASTICSEARCH_CONNECTIONS entry to send the actions to.'),
+    )
+    args = '[file]'
+    help = 'Sends the actions recorded in a dead letter file to elasticsearch again.'
+
+    def handle(self, *args, **options):
+        path = args[0] if args else get_dead_letter_path()
+        if not path:
+            raise CommandError("No file given, and ELASTICSEARCH_DEAD_LETTER_FILE is not set.")
+
+        # Actions that fail again are appended to the dead letter file, so
+        # replay from a copy.  A copy left by an interrupted replay is
+        # replayed instead, and the file is left for the next run, since it
+        # may now hold the copy's failures.
+        replaying = path + '.replaying'
+        if not os.path.exists(replaying):
+            if not os.path.exists(path):
+                print("No dead letters in %s" % path)
+                return
+            os.rename(path, replaying)
+        elif os.path.exists(path):
+            print("Replaying the actions left by an interrupted replay; run again for %s" % path)
+
+        sender = BulkSender(get_es(options['connection']), dead_letter_path=path)
+        success, errors = sender.send(read_dead_letters(replaying))
+        os.remove(replaying)
+        print("Replayed %d actions, %d failed again" % (success, len(errors)))
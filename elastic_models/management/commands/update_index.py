@@ -1,8 +1,22 @@
 from __future__ import print_function
 
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
 from elastic_models.management.commands import IndexCommand
+from elastic_models.checkpoints import Checkpoint, CheckpointLocked
 
 class Command(IndexCommand):
+    option_list = IndexCommand.option_list + (
+        make_option('--incremental', action="store_true", default=False, dest='incremental',
+            help='Index data modified since the last incremental run (or --since).'),
+        make_option('--force', action="store_true", default=False, dest='force',
+            help='Send every document, even if its fingerprint is unchanged.'),
+    )
+    checkpoint_name = 'update_index'
+
     def handle(self, *args, **options):
         indexes = self.get_indexes(args)
 
@@ -14,7 +28,47 @@ class Command(IndexCommand):
         if options['limit']:
             limit = int(options['limit'])
 
+        if options['force']:
+            for index in indexes:
+                index.forget_fingerprints()
+
+        if options['incremental']:
+            if int(options['workers']) > 1 or options['resume']:
+                raise CommandError("--incremental can't be combined with --workers or --resume")
+            if not getattr(settings, 'ELASTICSEARCH_CHECKPOINT_DIR', None):
+                # Losing the high-water mark with the temporary directory
+                # would mean indexing everything again.
+                raise CommandError("--incremental needs the ELASTICSEARCH_CHECKPOINT_DIR setting")
+            for index in indexes:
+                self.update_incremental(index, since, limit)
+            return
+
         for index in indexes:
             qs = index.get_filtered_queryset(since=since, limit=limit)
-            print("Indexing %d %s objects" % (qs.count(), index.model.__name__))
-            index.index_queryset(qs)
+            checkpoint = self.get_checkpoint(index, options['resume'])
+            if not checkpoint.exists():
+                print("Indexing %d %s objects" % (qs.count(), index.model.__name__))
+            else:
+                print("Resuming %s.%s after %d objects" % (index.model.__name__, index.name, checkpoint.count))
+            self.index_queryset(index, qs, checkpoint, options)
+            checkpoint.clear()
+
+    def update_incremental(self, index, since, limit):
+        # The high-water mark is kept between runs, unlike the checkpoints
+        # used to resume.
+        checkpoint = Checkpoint("%s.incremental.%s" % (self.checkpoint_name, index.get_label()),
+                                model=index.model)
+        try:
+            with checkpoint.lock():
+                checkpoint.load()
+                if 'date' in checkpoint.extra:
+                    # Rows between the high-water mark and since would be
+                    # skipped.
+                    since = None
+                qs = index.get_filtered_queryset(since=since)
+                success, errors = index.index_modified(qs, checkpoint, limit=limit)
+        except CheckpointLocked:
+            print("Skipping %s.%s, which another run is updating" % (index.model.__name__, index.name))
+            return
+
+        print("Indexed %d %s objects, %d errors" % (success, index.model.__name__, len(errors)))
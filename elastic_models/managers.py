@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+
+import logging
+
+from django.db import models, transaction
+
+from .buffer import queue_index
+from .receivers import bulk_deleting, get_dependents, queue_deleted, queue_saved
+
+logger = logging.getLogger(__name__)
+
+
+class IndexedQuerySet(models.QuerySet):
+    """
+    A QuerySet that keeps search indexes up to date after update() and
+    bulk_create(), which don't send post_save, and after delete(), which
+    would otherwise look up the dependents of each row separately.  The
+    affected documents are updated in bulk when the transaction commits,
+    like saved ones.
+
+    bulk_create() can only index the objects it sets the primary key of,
+    which depends on the database (e.g. PostgreSQL does).
+    """
+    # The number of rows update() changes at a time.
+    chunk_size = 1000
+
+    def get_pk_chunks(self):
+        """
+        Yields the primary keys of the rows matched, in ascending lists of at
+        most chunk_size.  Each chunk is fetched after the previous one was
+        processed.
+        """
+        qs = self.order_by('pk').values_list('pk', flat=True)
+        pks = list(qs[:self.chunk_size])
+        while pks:
+            yield pks
+            if len(pks) < self.chunk_size:
+                break
+            pks = list(qs.filter(pk__gt=pks[-1])[:self.chunk_size])
+
+    def update(self, **kwargs):
+        # The rows are updated a chunk at a time, in one transaction, so their
+        # primary keys needn't all be loaded.  The instances depending on them
+        # are found before the update as well as after it (by queue_saved),
+        # since changing a foreign key moves a row away from the ones that
+        # depended on it.
+        count = 0
+        with transaction.atomic(using=self.db):
+            for pks in self.get_pk_chunks():
+                dependent_pks = get_dependents(self.model, pks)
+                count += super(IndexedQuerySet, self.filter(pk__in=pks)).update(**kwargs)
+                queue_saved(self.model, pks, self.db, update_fields=kwargs.keys())
+                for index, index_pks in dependent_pks.items():
+                    for pk in index_pks:
+                        queue_index(index, pk, self.db)
+        return count
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(IndexedQuerySet, self).bulk_create(objs, *args, **kwargs)
+        pks = [obj.pk for obj in objs if obj.pk is not None]
+        if len(pks) < len(objs):
+            logger.warning("Not indexing %d %s objects created without primary keys"
+                           % (len(objs) - len(pks), self.model.__name__))
+        queue_saved(self.model, pks, self.db)
+        return objs
+
+    def delete(self):
+        # Once the rows are gone, the instances depending on them can't be
+        # found, so they are looked up first, for all the rows at once.  The
+        # rows deleted by cascades still go through the delete receivers.
+        pks = list(self.order_by().values_list('pk', flat=True))
+        dependent_pks = get_dependents(self.model, pks)
+        for index, index_pks in dependent_pks.items():
+            if index.model is self.model:
+                # The ones being deleted too needn't be.
+                index_pks.difference_update(pks)
+
+        with bulk_deleting(self.model, pks):
+            result = super(IndexedQuerySet, self).delete()
+        queue_deleted(self.model, pks, dependent_pks, self.db)
+        return result
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+IndexedManager = models.Manager.from_queryset(IndexedQuerySet)
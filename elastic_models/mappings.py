@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+
+from django.utils import six
+
+
+def normalize(value):
+    """
+    Converts a mapping or settings value to the form elasticsearch returns
+    it in, where settings are strings.
+    """
+    if isinstance(value, dict):
+        return dict((k, normalize(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return six.text_type(value)
+
+
+class MappingDiff(object):
+    """
+    The differences between the mapping and analysis settings an index
+    should have and the ones it has in the cluster.
+
+    Fields and analysis components (analyzers, tokenizers, filters...) that
+    are missing from the cluster can be added in place.  Ones whose
+    definitions changed can't, since documents already indexed were analyzed
+    with the old definition; the index has to be rebuilt.  Fields that exist
+    only in the cluster are ignored, since they can't be removed in place and
+    do no harm.
+    """
+    def __init__(self, mapping, live_mapping, analysis, live_analysis):
+        self.added_fields = []
+        self.changed_fields = []
+        self.added_analysis = {}
+        self.changed_analysis = []
+
+        self.compare_properties(mapping.get('properties', {}),
+                                live_mapping.get('properties', {}), ())
+
+        for kind, components in analysis.items():
+            live_components = live_analysis.get(kind, {})
+            for name, definition in components.items():
+                if name not in live_components:
+                    self.added_analysis.setdefault(kind, {})[name] = definition
+                elif normalize(definition) != normalize(live_components[name]):
+                    self.changed_analysis.append("%s.%s" % (kind, name))
+
+    def compare_properties(self, properties, live_properties, path):
+        for name, definition in properties.items():
+            field_path = path + (name,)
+            if name not in live_properties:
+                self.added_fields.append(".".join(field_path))
+                continue
+
+            live_definition = live_properties[name]
+            if 'properties' in live_definition:
+                # Elasticsearch leaves the type of object fields out.
+                live_definition = dict(live_definition)
+                live_definition.setdefault('type', 'object')
+
+            for key, value in definition.items():
+                if key == 'properties':
+                    self.compare_properties(value,
+                                            live_definition.get('properties', {}),
+                                            field_path)
+                elif normalize(value) != normalize(live_definition.get(key)):
+                    self.changed_fields.append(".".join(field_path))
+                    break
+
+    def __bool__(self):
+        return bool(self.added_fields or self.changed_fields or
+                    self.added_analysis or self.changed_analysis)
+    __nonzero__ = __bool__
+
+    @property
+    def is_compatible(self):
+        """
+        Whether the changes can be applied without rebuilding the index.
+        """
+        return not (self.changed_fields or self.changed_analysis)
+
+    def __str__(self):
+        parts = []
+        if self.added_fields:
+            parts.append("added fields: %s" % ", ".join(sorted(self.added_fields)))
+        if self.changed_fields:
+            parts.append("changed fields: %s" % ", ".join(sorted(self.changed_fields)))
+        added_analysis = ["%s.%s" % (kind, name)
+                          for kind, components in self.added_analysis.items()
+                          for name in components]
+        if added_analysis:
+            parts.append("added analysis: %s" % ", ".join(sorted(added_analysis)))
+        if self.changed_analysis:
+            parts.append("changed analysis: %s" % ", ".join(sorted(self.changed_analysis)))
+        return "; ".join(parts) or "no changes"
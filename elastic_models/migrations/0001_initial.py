@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 00:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.CharField(max_length=255)),
+                ('object_pk', models.CharField(max_length=255)),
+                ('op', models.CharField(choices=[('index', 'Index'), ('fanout', 'Fan-out')], default='index', max_length=16)),
+                ('field', models.CharField(blank=True, max_length=255)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('claimed_by', models.CharField(blank=True, db_index=True, max_length=32)),
+                ('claimed_on', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('elastic_models', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='outboxentry',
+            name='op',
+            field=models.CharField(choices=[('index', 'Index'), ('delete', 'Delete'), ('fanout', 'Fan-out')], default='index', max_length=16),
+        ),
+    ]
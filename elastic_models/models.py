@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class OutboxEntry(models.Model):
+    """
+    An index update waiting to be sent by the index_worker command.  Entries
+    are written in the same transaction as the change they record, when the
+    ELASTICSEARCH_OUTBOX setting is True.
+    """
+    INDEX = 'index'
+    DELETE = 'delete'
+    FANOUT = 'fanout'
+    OP_CHOICES = (
+        (INDEX, 'Index'),
+        (DELETE, 'Delete'),
+        (FANOUT, 'Fan-out'),
+    )
+
+    # The label of the index (see Index.get_label).
+    index = models.CharField(max_length=255)
+    # The primary key of the instance to index, or for fan-outs, of the
+    # dependency to copy into the documents.
+    object_pk = models.CharField(max_length=255)
+    op = models.CharField(max_length=16, choices=OP_CHOICES, default=INDEX)
+    # For fan-outs, the name of the field holding the copies.
+    field = models.CharField(max_length=255, blank=True)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    # Set by workers that can't lock rows with SELECT ... FOR UPDATE SKIP
+    # LOCKED.  See claim_entries.
+    claimed_by = models.CharField(max_length=32, blank=True, db_index=True)
+    claimed_on = models.DateTimeField(null=True, blank=True)
@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+from elasticsearch import TransportError
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.result import Response
+
+from .resultcache import CachedSearch, get_result_cache
+
+# Search parameters that can be given in an _msearch header.
+HEADER_PARAMS = ('search_type', 'preference', 'routing')
+
+
+class MultiSearch(object):
+    """
+    Executes several searches (e.g. from different Indexes) with a single
+    _msearch request per elasticsearch connection, rather than one request
+    each.  Searches are added with add, which returns the search; once the
+    MultiSearch is executed, executing the search returns its response
+    without another request.
+
+        with MultiSearch() as ms:
+            posts = ms.add(BlogPost.search.query("match", title="foo"))
+            authors = ms.add(Author.search.query("match", name="foo"))
+        posts.execute()
+
+    The searches are executed when the with block exits (unless it raised an
+    exception), or by calling execute.  Responses cached by the result cache
+    (see CachedSearch) aren't requested again.  If any of the searches fail,
+    a TransportError is raised for the first.
+    """
+    def __init__(self):
+        self.searches = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, search):
+        self.searches.append(search)
+        return search
+
+    def get_header(self, search):
+        header = {'index': search._index, 'type': search._doc_type}
+        header.update((k, v) for k, v in search._params.items() if k in HEADER_PARAMS)
+        return header
+
+    def execute(self):
+        """
+        Executes the searches that haven't been executed yet, and returns
+        the responses of all of them, in the order they were added.
+        """
+        cache = get_result_cache()
+        requests = OrderedDict()
+        for search in self.searches:
+            if hasattr(search, '_response'):
+                continue
+
+            body = search.to_dict()
+            key = None
+            if cache is not None and isinstance(search, CachedSearch):
+                key, data = cache.lookup(search._index, search.get_request(body=body))
+                if data is not None:
+                    search._response = Response(data, callbacks=search._doc_type_map)
+                    continue
+
+            es = connections.get_connection(search._using)
+            requests.setdefault(es, []).append((search, body, key))
+
+        errors = []
+        for es, items in requests.items():
+            lines = []
+            for search, body, key in items:
+                lines.extend([self.get_header(search), body])
+
+            responses = es.msearch(body=lines)['responses']
+            for (search, body, key), data in zip(items, responses):
+                if 'error' in data:
+                    # Raised once the other searches have their responses.
+                    errors.append(TransportError(data.get('status', 500), data['error']))
+                    continue
+                if key is not None:
+                    cache.store(key, data)
+                search._response = Response(data, callbacks=search._doc_type_map)
+
+        if errors:
+            raise errors[0]
+
+        return [search._response for search in self.searches]
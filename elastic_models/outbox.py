@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+
+import logging
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.utils.timezone import now
+
+from elasticsearch.helpers import BulkIndexError
+
+from .indexes import get_index_by_label
+from .models import OutboxEntry
+from .signals import instances_changed
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+# Claims older than this are assumed to belong to workers that died.
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def is_enabled():
+    return getattr(settings, 'ELASTICSEARCH_OUTBOX', False)
+
+
+def add_entry(index, pk, op=OutboxEntry.INDEX, field='', using=None):
+    OutboxEntry.objects.using(using or DEFAULT_DB_ALIAS).create(
+        index=index.get_label(), object_pk=pk, op=op, field=field)
+
+
+def can_skip_locked(using):
+    return getattr(connections[using].features, 'has_select_for_update_skip_locked', False)
+
+
+def process_batch(size=500, using=None):
+    """
+    Claims at most size outbox entries, sends them to elasticsearch and
+    deletes them.  Returns the number of entries processed.
+
+    Entries are claimed with SELECT ... FOR UPDATE SKIP LOCKED where the
+    database supports it, so several workers can run at once.  Elsewhere
+    (e.g. on SQLite) they are claimed by marking them with a token.  If
+    sending fails, the entries are left for another attempt.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    entries = OutboxEntry.objects.using(using).order_by('pk')
+
+    if can_skip_locked(using):
+        with transaction.atomic(using=using):
+            batch = list(entries.select_for_update(skip_locked=True)[:size])
+            if batch:
+                send_entries(batch)
+                entries.filter(pk__in=[e.pk for e in batch]).delete()
+            return len(batch)
+
+    token = uuid.uuid4().hex
+    unclaimed = Q(claimed_by='') | Q(claimed_on__lt=now() - CLAIM_TIMEOUT)
+    pks = list(entries.filter(unclaimed).values_list('pk', flat=True)[:size])
+    if not pks:
+        return 0
+
+    # Another worker may have claimed some of them since, so check again.
+    entries.filter(unclaimed, pk__in=pks).update(claimed_by=token, claimed_on=now())
+    claimed = entries.filter(claimed_by=token)
+    batch = list(claimed)
+    try:
+        send_entries(batch)
+    except Exception:
+        claimed.update(claimed_by='', claimed_on=None)
+        raise
+    claimed.delete()
+    return len(batch)
+
+
+def send_entries(entries):
+    """
+    Sends the updates recorded by a list of outbox entries, once for each
+    distinct (index, pk).
+    """
+    pending = defaultdict(set)
+    deletes = defaultdict(set)
+    fanouts = set()
+    # Entries are in the order they were written, so the last operation on
+    # each document wins.
+    for entry in entries:
+        if entry.op == OutboxEntry.FANOUT:
+            fanouts.add((entry.index, entry.field, entry.object_pk))
+        elif entry.op == OutboxEntry.DELETE:
+            pending[entry.index].discard(entry.object_pk)
+            deletes[entry.index].add(entry.object_pk)
+        else:
+            deletes[entry.index].discard(entry.object_pk)
+            pending[entry.index].add(entry.object_pk)
+
+    for label, pks in pending.items():
+        index = get_index_by_label(label)
+        sender = index.get_bulk_sender()
+        pks = sorted(index.model._meta.pk.to_python(pk) for pk in pks)
+        instances_changed.send(sender=index.model, pks=pks)
+        for chunk in chunked(pks, index._meta.index_by):
+            try:
+                sender.send(index.get_pk_actions(chunk))
+            except BulkIndexError as e:
+                # Sending these documents again won't help.
+                logger.error("Failed to index %d %s documents: %s"
+                             % (len(e.errors), label, e.errors))
+
+    for label, pks in deletes.items():
+        if pks:
+            index = get_index_by_label(label)
+            pks = sorted(index.model._meta.pk.to_python(pk) for pk in pks)
+            instances_changed.send(sender=index.model, pks=pks)
+            index.get_bulk_sender().send(index.get_delete_actions(pks))
+
+    for label, field, pk in fanouts:
+        index = get_index_by_label(label)
+        model = dict((f, m) for m, f in index.get_denormalized().items())[field]
+        instance = model._default_manager.filter(pk=pk).first()
+        if instance is not None:
+            index.fanout(field, instance)
@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import logging
+import multiprocessing
+
+from django.apps import apps
+
+from elasticsearch.helpers import BulkIndexError
+
+from .indexes import get_index_by_label, reset_connections, _split_limits
+from .fingerprints import reset_fingerprint_store
+from .resultcache import invalidate_results, reset_result_cache
+from .utils import close_db_connections
+
+logger = logging.getLogger(__name__)
+
+
+def get_pk_ranges(qs, count):
+    """
+    Splits qs into at most count contiguous primary key ranges holding
+    roughly the same number of rows.  Returns a list of (start_after, end)
+    pairs, either of which is None when the range is unbounded on that side.
+    """
+    qs, start_after, limit = _split_limits(qs)
+    pks = qs.order_by('pk').values_list('pk', flat=True)
+    if start_after is not None:
+        pks = pks.filter(pk__gt=start_after)
+
+    total = pks.count()
+    if limit is not None:
+        total = min(total, limit)
+
+    ranges = []
+    previous = -1
+    for number in range(1, count + 1):
+        position = number * total // count - 1
+        if position <= previous:
+            continue
+        previous = position
+
+        if number == count and limit is None:
+            # Include rows created while we are indexing.
+            end = None
+        else:
+            end = pks[position]
+        ranges.append((start_after, end))
+        start_after = end
+
+    return ranges
+
+
+def _init_worker():
+    if not apps.ready:
+        # Processes that are spawned rather than forked start from scratch.
+        import django
+        django.setup()
+
+    # Connections inherited from the parent process can't be shared.
+    close_db_connections()
+    reset_connections()
+    reset_fingerprint_store()
+    reset_result_cache()
+
+
+def _index_range(args):
+    label, query, start_after, end, checkpoint, pipeline, index_name = args
+    index = get_index_by_label(label)
+
+    qs = index.get_queryset()
+    qs.query = query
+    if start_after is not None:
+        qs = qs.filter(pk__gt=start_after)
+    if end is not None:
+        qs = qs.filter(pk__lte=end)
+
+    resumed_after = checkpoint.last_pk if checkpoint is not None else None
+    try:
+        success, errors = index.index_queryset(qs, checkpoint=checkpoint,
+                                               pipeline=pipeline,
+                                               index_name=index_name)
+    except BulkIndexError as e:
+        # The whole range was sent, and only the documents in e.errors failed.
+        sent = qs if resumed_after is None else qs.filter(pk__gt=resumed_after)
+        success, errors = sent.count() - len(e.errors), e.errors
+    finally:
+        close_db_connections()
+
+    return success, errors
+
+
+def index_in_parallel(index, qs, workers, checkpoint=None, pipeline=None,
+                      index_name=None):
+    """
+    Indexes qs using a pool of worker processes, each of which indexes a
+    primary key range with its own database and elasticsearch connections.
+    Returns the combined number of documents indexed and list of errors.
+
+    If a Checkpoint is given, the ranges and each worker's progress are
+    recorded in it, and an interrupted run resumes with the same ranges.
+    """
+    if checkpoint is not None and checkpoint.ranges is not None:
+        ranges = [tuple(r) for r in checkpoint.ranges]
+    else:
+        ranges = get_pk_ranges(qs, workers)
+        if checkpoint is not None:
+            checkpoint.ranges = ranges
+            checkpoint.save()
+
+    qs = _split_limits(qs)[0]
+    label = index.get_label()
+    tasks = []
+    for number, (start_after, end) in enumerate(ranges):
+        range_checkpoint = None
+        if checkpoint is not None:
+            range_checkpoint = checkpoint.get_range_checkpoint(number)
+        tasks.append((label, qs.query, start_after, end, range_checkpoint,
+                      pipeline, index_name))
+
+    # Don't let the workers inherit our database connections.
+    close_db_connections()
+
+    success = 0
+    errors = []
+    pool = multiprocessing.Pool(min(workers, len(tasks)) or 1, initializer=_init_worker)
+    try:
+        for range_success, range_errors in pool.imap_unordered(_index_range, tasks):
+            success += range_success
+            errors.extend(range_errors)
+            logger.debug("Indexed a range of %s: %d documents, %d errors"
+                         % (label, range_success, len(range_errors)))
+    finally:
+        pool.terminate()
+        pool.join()
+        # The workers' writes only invalidate their own in-process caches.
+        invalidate_results([index_name or index.get_index()])
+
+    return success, errors
@@ -0,0 +1,188 @@
+from __future__ import absolute_import
+
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from django.utils import six
+from django.utils.six.moves.queue import Queue, Empty, Full
+
+from elasticsearch.helpers import BulkIndexError
+
+from .utils import close_db_connections
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output.
+_DONE = object()
+
+
+class StageStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.waiting = 0.0
+        self.chunks = 0
+        self.max_depth = 0
+
+    def __str__(self):
+        return ("%s: %d chunks, %.2fs busy, %.2fs waiting, max queue depth %d"
+                % (self.name, self.chunks, self.busy, self.waiting, self.max_depth))
+
+
+class IndexPipeline(object):
+    """
+    Indexes a queryset with database reads, document preparation and bulk
+    requests running concurrently.  A reader thread fetches chunks of
+    instances, the calling thread prepares their documents, and a sender
+    thread sends them to elasticsearch.  The stages are connected by queues
+    holding at most depth chunks, so a slow stage holds the others back.
+
+    The reader thread uses its own database connection, so it can't see
+    changes made by the calling thread's uncommitted transaction.
+    """
+    def __init__(self, index, depth=4):
+        self.index = index
+        self.depth = depth
+        self.stats = OrderedDict(
+            (name, StageStats(name)) for name in ('fetch', 'prepare', 'send'))
+
+    def run(self, qs, checkpoint=None, index_name=None):
+        self.index_name = index_name
+        self.stop = threading.Event()
+        self.exc_info = None
+        self.success = 0
+        self.errors = []
+        self.failed = []
+
+        prepare_queue = Queue(self.depth)
+        send_queue = Queue(self.depth)
+
+        start_after, done = None, 0
+        if checkpoint is not None:
+            start_after, done = checkpoint.last_pk, checkpoint.count
+
+        threads = [
+            threading.Thread(target=self.run_stage,
+                             args=(self.fetch, qs, start_after, done, prepare_queue)),
+            threading.Thread(target=self.run_stage,
+                             args=(self.send, send_queue, checkpoint)),
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            self.run_stage(self.prepare, prepare_queue, send_queue)
+        except BaseException:
+            self.stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+
+        logger.info("Pipeline for %s:\n%s" % (
+            self.index.get_label(), "\n".join(str(s) for s in self.stats.values())))
+
+        if self.exc_info is not None:
+            six.reraise(*self.exc_info)
+        if self.failed:
+            raise BulkIndexError('%i document(s) failed to index.' % len(self.failed), self.failed)
+
+        return self.success, self.errors
+
+    def run_stage(self, stage, *args):
+        try:
+            stage(*args)
+        except Exception:
+            if self.exc_info is None:
+                self.exc_info = sys.exc_info()
+            self.stop.set()
+
+    def put(self, queue, item, stats):
+        start = time.time()
+        try:
+            while not self.stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    stats.max_depth = max(stats.max_depth, queue.qsize())
+                    return True
+                except Full:
+                    continue
+            return False
+        finally:
+            stats.waiting += time.time() - start
+
+    def get(self, queue, stats):
+        start = time.time()
+        try:
+            while True:
+                try:
+                    return queue.get(timeout=0.1)
+                except Empty:
+                    if self.stop.is_set():
+                        return _DONE
+        finally:
+            stats.waiting += time.time() - start
+
+    def fetch(self, qs, start_after, done, out):
+        stats = self.stats['fetch']
+        chunks = self.index.get_chunks(qs, start_after=start_after, done=done)
+        try:
+            while True:
+                start = time.time()
+                instances = next(chunks, None)
+                stats.busy += time.time() - start
+                if instances is None:
+                    break
+
+                stats.chunks += 1
+                if not self.put(out, instances, stats):
+                    break
+        finally:
+            self.put(out, _DONE, stats)
+            close_db_connections()
+
+    def prepare(self, inq, out):
+        stats = self.stats['prepare']
+        try:
+            while True:
+                instances = self.get(inq, stats)
+                if instances is _DONE:
+                    break
+
+                start = time.time()
+                actions = list(self.index.get_instance_actions(instances, self.index_name))
+                stats.busy += time.time() - start
+
+                stats.chunks += 1
+                if not self.put(out, (actions, instances[-1].pk, len(instances)), stats):
+                    break
+        finally:
+            self.put(out, _DONE, stats)
+
+    def send(self, inq, checkpoint):
+        stats = self.stats['send']
+        sender = self.index.get_bulk_sender()
+        while True:
+            item = self.get(inq, stats)
+            if item is _DONE:
+                break
+            actions, last_pk, count = item
+
+            start = time.time()
+            try:
+                success, errors = sender.send(actions)
+            except BulkIndexError as e:
+                # The other chunks are still sent; see run.
+                success, errors = count - len(e.errors), e.errors
+                self.failed.extend(e.errors)
+            stats.busy += time.time() - start
+
+            stats.chunks += 1
+            self.success += success
+            self.errors.extend(errors)
+            if checkpoint is not None:
+                checkpoint.update(last_pk, count)
@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+import django
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query import Prefetch, prefetch_related_objects
+from django.db.models.constants import LOOKUP_SEP
+
+
+class QueryPlan(object):
+    """
+    The select_related and prefetch_related lookups needed to prepare the
+    documents for a queryset without a query per row per related field.
+
+    Each path is a sequence of attribute names starting from model, like an
+    AttributeField's path.  Forward foreign keys and one-to-one relations at
+    the start of a path are joined with select_related; the first
+    multi-valued relation and everything after it is prefetched.
+
+    When restrict_columns is True, the querysets of the first prefetched
+    relations are restricted to the columns the paths read.  Restriction is
+    skipped for any relation whose instances are used as a whole (e.g.
+    rendered with str()), or that a path reads through a method or property.
+    """
+    def __init__(self, model, paths=(), restrict_columns=True):
+        self.model = model
+        self.restrict_columns = restrict_columns
+        self.select_related = []
+        # Maps each prefetch lookup to (related model, required columns, columns
+        # read through it).  The columns read is None when restriction is not
+        # possible.
+        self.prefetch_related = OrderedDict()
+
+        for path in paths:
+            self.add_path(path)
+
+    def get_field(self, model, name):
+        if name == 'pk':
+            return model._meta.pk
+        try:
+            return model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def add_path(self, path, reads_columns=True):
+        """
+        Adds the relations traversed by path to the plan.  Pass reads_columns
+        False for paths that only name relations, such as dependency lookups,
+        and should not affect which columns are loaded.
+        """
+        model = self.model
+        lookup = []
+        prefetch = None
+
+        for name in path:
+            field = self.get_field(model, name)
+
+            if prefetch is not None and len(lookup) == len(prefetch.split(LOOKUP_SEP)):
+                # The attribute read from each prefetched instance.
+                self.add_column(prefetch, field, name, reads_columns)
+
+            if field is None or not field.is_relation:
+                break
+
+            lookup.append(name)
+
+            if prefetch is None and field.related_model is not None and \
+                    (field.many_to_one or field.one_to_one):
+                joined = LOOKUP_SEP.join(lookup)
+                if joined not in self.select_related:
+                    self.select_related.append(joined)
+            else:
+                joined = LOOKUP_SEP.join(lookup)
+                if prefetch is None:
+                    prefetch = joined
+                    self.add_prefetch(joined, field)
+                elif joined not in self.prefetch_related:
+                    self.prefetch_related[joined] = (None, (), None)
+
+            if field.related_model is None:
+                # Generic foreign keys can only be prefetched, and we can't
+                # follow them any further.
+                break
+            model = field.related_model
+        else:
+            if prefetch is not None and LOOKUP_SEP.join(lookup) == prefetch and reads_columns:
+                # The prefetched instances themselves are used.
+                self.unrestrict(prefetch)
+
+    def add_prefetch(self, lookup, field):
+        if lookup in self.prefetch_related:
+            return
+
+        model = field.related_model
+        required = None
+        if model is not None:
+            if field.one_to_many and hasattr(field, 'field'):
+                # The reverse foreign key is needed to match the prefetched
+                # instances to ours.
+                required = (model._meta.pk.name, field.field.name)
+            elif field.many_to_many:
+                required = (model._meta.pk.name,)
+
+        if required is None or not self.restrict_columns:
+            self.prefetch_related[lookup] = (model, (), None)
+        else:
+            self.prefetch_related[lookup] = (model, required, set())
+
+    def add_column(self, lookup, field, name, reads_columns):
+        if not reads_columns:
+            return
+        if field is None:
+            self.unrestrict(lookup)
+        elif field.concrete and not field.many_to_many:
+            model, required, columns = self.prefetch_related[lookup]
+            if columns is not None:
+                columns.add(field.name)
+
+    def unrestrict(self, lookup):
+        model, required, columns = self.prefetch_related[lookup]
+        self.prefetch_related[lookup] = (model, required, None)
+
+    def get_prefetch_lookups(self):
+        lookups = []
+        for lookup, (model, required, columns) in self.prefetch_related.items():
+            if columns is None:
+                lookups.append(lookup)
+            else:
+                only = sorted(set(required) | columns)
+                queryset = model._default_manager.only(*only)
+                lookups.append(Prefetch(lookup, queryset=queryset))
+        return lookups
+
+    def apply(self, qs):
+        """
+        Applies the parts of the plan that can be done in the query itself.
+        """
+        if self.select_related:
+            qs = qs.select_related(*self.select_related)
+        return qs
+
+    def prefetch(self, instances):
+        """
+        Prefetches related objects for a chunk of instances.
+        """
+        lookups = self.get_prefetch_lookups()
+        if not instances or not lookups:
+            return
+        if django.VERSION[:2] < (1, 10):
+            prefetch_related_objects(instances, lookups)
+        else:
+            prefetch_related_objects(instances, *lookups)
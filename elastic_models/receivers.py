@@ -1,69 +1,372 @@
 import logging
+import operator
+import sqlite3
+import threading
+from collections import defaultdict
 from contextlib import contextmanager
-from datetime import timedelta
+from functools import reduce
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.db import models
+from django.db.models import Q
 from django.dispatch import receiver
-from django.utils.timezone import now
+from django.utils import six
 
-from .indexes import index_registry
+from .indexes import index_registry, get_dispatch_entries, get_dependency_graph
+from .buffer import queue_index, queue_delete, queue_fanout
+from .utils import chunked
 
 #A list of sets to allow nested/concurent use
 suspended_models = []
 
+# The number of saved primary keys a suspended_updates block keeps in memory
+# before writing them to a temporary database.
+SUSPENSION_MEMORY_LIMIT = 100000
+# The number of saved primary keys whose dependents are looked up at once
+# when a suspended_updates block exits.
+SUSPENSION_CHUNK_SIZE = 1000
+
 def get_search_models():
     return set(m for (m, a) in index_registry.keys())
 
 def is_suspended(model):
-    for models in suspended_models:
+    for models in list(suspended_models):
         if model in models:
             return True
     return False
 
+def record_suspended(model, pk):
+    """
+    Records a save of a suspended model in the innermost suspended_updates
+    block suspending it.  Returns False if the block is already exiting.
+    """
+    for models in reversed(list(suspended_models)):
+        if model in models:
+            return models.record(model, pk)
+    return False
+
+
+class PrimaryKeySpool(object):
+    """
+    Sets of primary keys, each under a key (a model or an index), held in
+    memory up to memory_limit of them, and in a temporary SQLite database
+    beyond that.  They are read back in sorted chunks, so none of the sets
+    has to fit in memory.
+    """
+    def __init__(self, memory_limit):
+        self.memory_limit = memory_limit
+        self.pending = defaultdict(set)
+        self.pending_count = 0
+        # Maps keys to the ids they are stored under, in the order added.
+        self.key_ids = {}
+        self.db = None
+
+    def get_keys(self):
+        return sorted(self.key_ids, key=self.key_ids.get)
+
+    def add(self, key, pks):
+        self.key_ids.setdefault(key, len(self.key_ids))
+        pending = self.pending[key]
+        count = len(pending)
+        pending.update(pks)
+        self.pending_count += len(pending) - count
+        if self.pending_count >= self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        if self.db is None:
+            # An empty name opens a private database in a temporary file.
+            self.db = sqlite3.connect('', check_same_thread=False)
+            self.db.execute("CREATE TABLE pks (key INTEGER, pk, PRIMARY KEY (key, pk))")
+        for key, pks in self.pending.items():
+            self.db.executemany(
+                "INSERT OR IGNORE INTO pks VALUES (?, ?)",
+                ((self.key_ids[key], pk if isinstance(pk, six.integer_types) else six.text_type(pk))
+                 for pk in pks))
+        self.pending.clear()
+        self.pending_count = 0
+
+    def get_chunks(self, key, size, to_python=None):
+        """
+        Yields the primary keys added under key in sorted lists of at most
+        size.  Spilled keys were stored as integers or text, and are
+        converted back with to_python.
+        """
+        if self.db is None:
+            for chunk in chunked(sorted(self.pending.get(key, ())), size):
+                yield chunk
+            return
+
+        if self.pending:
+            self.spill()
+        query = "SELECT pk FROM pks WHERE key = ? AND pk > ? ORDER BY pk LIMIT ?"
+        key_id = self.key_ids[key]
+        # Integers sort before text in SQLite.
+        after = -float('inf')
+        while True:
+            pks = [pk for (pk,) in self.db.execute(query, (key_id, after, size))]
+            if not pks:
+                break
+            yield [to_python(pk) for pk in pks] if to_python else pks
+            after = pks[-1]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.pending.clear()
+        self.pending_count = 0
+        self.key_ids.clear()
+
+
+class Suspension(set):
+    """
+    The set of models whose updates a suspended_updates block suspends.  It
+    also records the primary keys of the instances of those models saved
+    during the block, in a PrimaryKeySpool.
+    """
+    def __init__(self, models, memory_limit=None):
+        super(Suspension, self).__init__(models)
+        self.memory_limit = memory_limit or SUSPENSION_MEMORY_LIMIT
+        self.lock = threading.Lock()
+        self.saved = PrimaryKeySpool(self.memory_limit)
+        self.closed = False
+
+    def record(self, model, pk):
+        with self.lock:
+            if self.closed:
+                return False
+            self.saved.add(model, [pk])
+            return True
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+    def get_saved(self, size=SUSPENSION_CHUNK_SIZE):
+        """
+        Yields (model, pks) pairs with the primary keys of the saved
+        instances of each model, in sorted chunks of at most size.
+        """
+        for model in self.saved.get_keys():
+            for pks in self.saved.get_chunks(model, size, model._meta.pk.to_python):
+                yield model, pks
+
+    def get_index_chunks(self):
+        """
+        Yields (index, pks) pairs with the primary keys of the instances to
+        re-index in each index, including the ones that depend on the saved
+        instances, in sorted chunks of the index's index_by.
+        """
+        index_pks = PrimaryKeySpool(self.memory_limit)
+        try:
+            for model, pks in self.get_saved():
+                for index, own, paths in get_dispatch_entries(model):
+                    if own:
+                        index_pks.add(index, pks)
+                    if paths:
+                        index_pks.add(index, get_dependent_pks(index, paths, pks))
+
+            for index in index_pks.get_keys():
+                to_python = index.model._meta.pk.to_python
+                for pks in index_pks.get_chunks(index, index._meta.index_by, to_python):
+                    yield index, pks
+        finally:
+            index_pks.close()
+
+    def clear_saved(self):
+        self.saved.close()
+
+
+def get_dependent_queryset(index, paths, instance):
+    """
+    Returns the instances of index's model that depend on instance through
+    any of the given lookup paths.
+    """
+    query = reduce(operator.or_, (Q(**{path: instance}) for path in paths))
+    return index.get_queryset().filter(query).distinct()
+
+def get_dependent_pks(index, paths, pks):
+    """
+    Returns the primary keys of the instances of index's model that depend,
+    through any of the given lookup paths, on the instances with the given
+    primary keys.
+    """
+    dependent_pks = set()
+    for chunk in chunked(pks, 1000):
+        query = reduce(operator.or_, (Q(**{'%s__in' % path: chunk}) for path in paths))
+        qs = index.get_queryset().filter(query).distinct()
+        dependent_pks.update(qs.values_list('pk', flat=True))
+    return dependent_pks
+
+def get_dependents(model, pks):
+    """
+    Returns a dictionary mapping each index that depends on model to the
+    primary keys of its instances that depend on the instances of model
+    with the given primary keys.
+    """
+    return dict((index, get_dependent_pks(index, paths, pks))
+                for index, own, paths in get_dispatch_entries(model) if paths)
+
+def queue_saved(model, pks, using=None, update_fields=None):
+    """
+    Queues index updates for instances of model saved in bulk, which don't
+    send post_save.  update_fields is as for post_save.
+    """
+    if is_suspended(model):
+        pks = [pk for pk in pks if not record_suspended(model, pk)]
+
+    for index, own, paths in get_dispatch_entries(model):
+        if own:
+            fields = None
+            if update_fields is not None:
+                fields = index.get_affected_fields(update_fields)
+            # Nothing is sent if none of the indexed fields were saved, unless
+            # they may decide whether the instances are indexed.  Then an
+            # empty update is sent, which indexes missing documents in full.
+            if fields is None or fields or index.membership_may_change(update_fields):
+                # Whether they should be indexed is checked when the updates
+                # are sent.
+                for pk in pks:
+                    queue_index(index, pk, using, fields)
+
+        if paths:
+            for pk in get_dependent_pks(index, paths, pks):
+                queue_index(index, pk, using)
+
+def queue_deleted(model, pks, dependent_pks, using=None):
+    """
+    Queues the deletion of the documents for instances of model deleted in
+    bulk, and updates of the instances that depended on them.  Dependent
+    pks must be found before the deletion, with get_dependent_pks.
+    """
+    for index, own, paths in get_dispatch_entries(model):
+        if own:
+            for pk in pks:
+                queue_delete(index, pk, using)
+    for index, index_pks in dependent_pks.items():
+        for pk in index_pks:
+            queue_index(index, pk, using)
+
+
 @receiver(post_save)
 def update_search_index(sender, **kwargs):
-    if is_suspended(sender):
+    instance = kwargs['instance']
+    if is_suspended(sender) and record_suspended(sender, instance.pk):
         return
     
-    instance = kwargs['instance']
+    using = kwargs.get('using')
+    update_fields = kwargs.get('update_fields')
     
-    for index in index_registry.values():
-        if issubclass(sender, index.model) and index.should_index(instance):
-            index.index_instance(instance)
-            continue
+    for index, own, paths in get_dispatch_entries(sender):
+        if own:
+            fields = None
+            if update_fields is not None:
+                fields = index.get_affected_fields(update_fields)
+
+            # Nothing is sent if none of the indexed fields were saved, unless
+            # they may decide whether the instance is indexed.  Then an empty
+            # update is sent, which indexes a missing document in full.
+            if fields is None or fields or index.membership_may_change(update_fields):
+                # If it can't be decided now, it is checked (in bulk) when
+                # the update is sent.
+                if index.is_included(instance) is not False:
+                    queue_index(index, instance.pk, using, fields)
+                    continue
+                # It may have been indexed before.
+                queue_delete(index, instance.pk, using)
         
-        dependencies = index.get_dependencies()
-        if sender in dependencies:
-            filter_kwargs = {
-                dependencies[sender]: instance
-            }
-            qs = index.get_queryset().filter(**filter_kwargs)
-            index.index_queryset(qs)
+        if paths:
+            name = index.get_denormalized().get(sender)
+            if name is not None and not kwargs.get('created'):
+                # Patch the copies of instance on the cluster.  New instances
+                # aren't in any document yet, so they go the slow way.
+                queue_fanout(index, name, instance, using)
+            else:
+                qs = get_dependent_queryset(index, paths, instance)
+                for pk in qs.values_list('pk', flat=True):
+                    queue_index(index, pk, using)
 
 
-SUSPENSION_BUFFER_TIME = timedelta(seconds=10)
+# The primary keys, by model, of the rows that IndexedQuerySet.delete calls
+# in this thread are deleting.  Their documents and dependents are updated
+# in bulk, so the delete receivers skip them.
+_bulk_deletes = threading.local()
+
+@contextmanager
+def bulk_deleting(model, pks):
+    previous = getattr(_bulk_deletes, 'pks', {})
+    current = dict(previous)
+    current[model] = previous.get(model, frozenset()) | frozenset(pks)
+    _bulk_deletes.pks = current
+    try:
+        yield
+    finally:
+        _bulk_deletes.pks = previous
+
+def is_bulk_deleted(model, pk):
+    return pk in getattr(_bulk_deletes, 'pks', {}).get(model, ())
+
+def collect_dependents(sender, **kwargs):
+    """
+    Finds the instances depending on one about to be deleted, since they
+    can't be found through it once it's gone.
+    """
+    instance = kwargs['instance']
+    if is_bulk_deleted(sender, instance.pk):
+        # IndexedQuerySet.delete handles the whole batch.
+        return
+    instance._em_dependent_pks = get_dependents(sender, [instance.pk])
+
+def delete_from_search_index(sender, **kwargs):
+    instance = kwargs['instance']
+    if is_bulk_deleted(sender, instance.pk):
+        return
+    dependent_pks = getattr(instance, '_em_dependent_pks', {})
+    queue_deleted(sender, [instance.pk], dependent_pks, kwargs.get('using'))
+
+def connect_delete_receivers(indexes=None):
+    """
+    Connects the delete receivers to the models that affect the given
+    indexes (by default, all of them).  Connecting them to every model would
+    keep Django from deleting the other models' rows in bulk.
+    """
+    graph = get_dependency_graph()
+    for index in indexes or index_registry.values():
+        for model in set([index.model]) | graph.get_dependency_models(index):
+            uid = 'elastic_models.%s.%s' % (model._meta.app_label, model._meta.model_name)
+            pre_delete.connect(collect_dependents, sender=model, dispatch_uid=uid)
+            post_delete.connect(delete_from_search_index, sender=model, dispatch_uid=uid)
+
 
 @contextmanager
 def suspended_updates(models=None):
-    search_models = get_search_models()
-    
+    """
+    Suspends index updates for saves of the given models (by default, all of
+    the indexed models) until the block exits.  The primary keys of the
+    instances saved in the meantime are recorded, and on exit exactly those
+    instances, and the ones depending on them, are re-indexed in primary key
+    order.
+    """
     if not models:
-        models = search_models
-    
-    models = set(models)
+        models = get_search_models()
     
-    start = now() - SUSPENSION_BUFFER_TIME
-    suspended_models.append(models)
+    suspension = Suspension(models)
+    suspended_models.append(suspension)
     
     try:
         yield
     finally:
-        suspended_models.remove(models)
-        
-        for index in index_registry.values():
-            if index.model in models or models.intersection(index.get_dependencies()):
-                qs = index.get_filtered_queryset(since=start)
-                index.index_queryset(qs)
+        # Blocks with the same models are equal, so remove this one by
+        # identity.
+        for i, models in enumerate(suspended_models):
+            if models is suspension:
+                del suspended_models[i]
+                break
+        suspension.close()
 
-            
+        try:
+            for index, pks in suspension.get_index_chunks():
+                index.index_queryset(index.get_queryset().filter(pk__in=pks))
+        finally:
+            suspension.clear_saved()
@@ -0,0 +1,119 @@
+from __future__ import absolute_import
+
+import logging
+from itertools import chain
+
+from elasticsearch.helpers import scan
+
+from .utils import chunked
+
+logger = logging.getLogger(__name__)
+
+
+def get_document_pks(index, size=1000, index_name=None):
+    """
+    Yields the primary keys of the documents in index (or in its generation
+    index_name), in ascending order, scrolling through them size at a time.
+    """
+    to_python = index.model._meta.pk.to_python
+    body = {
+        'query': {'match_all': {}},
+        'sort': [{'pk': 'asc'}],
+        '_source': False,
+    }
+    hits = scan(index.get_es(), query=body, index=index_name or index.get_index(),
+                doc_type=index.get_doc_type(), preserve_order=True, size=size)
+    for hit in hits:
+        yield to_python(hit['_id'])
+
+
+def get_row_pks(index, size=1000):
+    """
+    Yields the primary keys of the rows in index's queryset, in ascending
+    order, fetching size at a time.
+    """
+    qs = index.get_queryset().order_by('pk').values_list('pk', flat=True)
+    last_pk = None
+    while True:
+        chunk_qs = qs if last_pk is None else qs.filter(pk__gt=last_pk)
+        pks = list(chunk_qs[:size])
+        for pk in pks:
+            yield pk
+        if len(pks) < size:
+            break
+        last_pk = pks[-1]
+
+
+def diff_sorted(document_pks, row_pks):
+    """
+    Merges two ascending sequences of primary keys, yielding ('orphan', pk)
+    for documents without a row, and ('missing', pk) for rows without a
+    document.
+    """
+    done = object()
+    document_pk = next(document_pks, done)
+    row_pk = next(row_pks, done)
+    while document_pk is not done or row_pk is not done:
+        if row_pk is done or (document_pk is not done and document_pk < row_pk):
+            yield 'orphan', document_pk
+            document_pk = next(document_pks, done)
+        elif document_pk is done or row_pk < document_pk:
+            yield 'missing', row_pk
+            row_pk = next(row_pks, done)
+        else:
+            document_pk = next(document_pks, done)
+            row_pk = next(row_pks, done)
+
+
+class Reconciliation(object):
+    """
+    Compares the documents in an index with the rows in its queryset,
+    deleting documents without a row and indexing rows without a document.
+    Both sets of primary keys are streamed in order and merged, so memory
+    use doesn't depend on their size.
+
+    With dry_run, nothing is changed, and the first sample_size orphans and
+    missing rows are collected for reporting.  With index_missing False,
+    only orphans are deleted.  index_name is the generation to reconcile,
+    if not the live index (see Index.create_generation).
+    """
+    def __init__(self, index, dry_run=False, sample_size=10, index_missing=True,
+                 index_name=None):
+        self.index = index
+        self.dry_run = dry_run
+        self.sample_size = sample_size
+        self.index_missing = index_missing
+        self.index_name = index_name
+        self.counts = {'orphan': 0, 'missing': 0}
+        self.samples = {'orphan': [], 'missing': []}
+        self.errors = []
+
+    def run(self):
+        size = self.index._meta.index_by
+        differences = diff_sorted(get_document_pks(self.index, size, self.index_name),
+                                  get_row_pks(self.index, size))
+        sender = self.index.get_bulk_sender()
+
+        for chunk in chunked(differences, size):
+            orphans = [pk for kind, pk in chunk if kind == 'orphan']
+            missing = [pk for kind, pk in chunk if kind == 'missing']
+            self.record('orphan', orphans)
+            self.record('missing', missing)
+            if self.dry_run:
+                continue
+
+            actions = [self.index.get_delete_actions(orphans, self.index_name)]
+            if missing and self.index_missing:
+                # Their fingerprints would make them look already sent.
+                self.index.forget_fingerprints(missing)
+                qs = self.index.get_queryset().filter(pk__in=missing)
+                actions.append(self.index.get_index_actions(qs, self.index_name))
+            success, errors = sender.send(chain.from_iterable(actions))
+            self.errors.extend(errors)
+
+        return self.counts
+
+    def record(self, kind, pks):
+        self.counts[kind] += len(pks)
+        sample = self.samples[kind]
+        sample.extend(pks[:self.sample_size - len(sample)])
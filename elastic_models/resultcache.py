@@ -0,0 +1,284 @@
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from elasticsearch import TransportError
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.result import Response
+
+from .connections import get_es
+from .search import IndexSearch
+
+logger = logging.getLogger(__name__)
+
+_cache = []
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Returns the ResultCache configured by the ELASTICSEARCH_RESULT_CACHE
+    setting, or None if there isn't one.  Like ELASTICSEARCH_FINGERPRINTS, the
+    setting is a dictionary with a BACKEND class path and OPTIONS passed to it.
+    """
+    with _cache_lock:
+        if not _cache:
+            config = getattr(settings, 'ELASTICSEARCH_RESULT_CACHE', None)
+            cache = None
+            if config:
+                cache = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+            _cache.append(cache)
+        return _cache[0]
+
+def reset_result_cache():
+    with _cache_lock:
+        del _cache[:]
+
+def get_cached_indexes(indexes):
+    """
+    Returns a dictionary mapping connection names to the names, among the
+    given elasticsearch indexes (or aliases), of the registered indexes
+    whose results are cached (see the cache_results Meta option).
+    """
+    # The indexes module imports this one.
+    from .indexes import index_registry
+
+    cached = defaultdict(set)
+    for index in index_registry.values():
+        if index._meta.cache_results and index.get_index() in indexes:
+            cached[index._meta.connection].add(index.get_index())
+    return cached
+
+def invalidate_results(indexes, refresh=True):
+    """
+    Discards the cached results of searches on the given elasticsearch
+    indexes (or aliases), after writing to them.  Unless refresh is False,
+    the ones with cached results are refreshed first, so the writes are
+    searchable before the new generation starts.  Otherwise a search in
+    between would cache a stale response under it.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return
+    indexes = set(indexes)
+    if refresh:
+        for connection, names in get_cached_indexes(indexes).items():
+            try:
+                get_es(connection).indices.refresh(index=",".join(sorted(names)))
+            except TransportError as e:
+                logger.warning("Failed to refresh %s before discarding their cached results: %s"
+                               % (", ".join(sorted(names)), e))
+    for index in indexes:
+        cache.bump(index)
+
+def dumps(data):
+    return json.dumps(data, sort_keys=True, default=JSONSerializer().default)
+
+
+class ResultCache(object):
+    """
+    Caches the responses of searches, keyed by the request and the
+    generation of each index searched.  Writing to an index bumps its
+    generation (see invalidate_results), so the responses cached before are
+    never used again.  hits counts the responses found in the cache, and
+    misses the ones requested from elasticsearch.
+
+    Subclasses implement get, set, get_generation and bump.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the value stored for key, or None.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def get_generation(self, index):
+        raise NotImplementedError
+
+    def bump(self, index):
+        """
+        Starts a new generation for index.
+        """
+        raise NotImplementedError
+
+    def get_key(self, indexes, request):
+        generations = [self.get_generation(index) for index in indexes]
+        data = dumps([indexes, generations, request])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def lookup(self, indexes, request):
+        """
+        Returns the key for request, a JSON serializable description of a
+        search on indexes, and its cached response (or None).  Responses
+        looked up but not found should be stored with store.
+        """
+        key = self.get_key(indexes, request)
+        # Stored serialized, since Responses modify the data they wrap.
+        value = self.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, (json.loads(value) if value is not None else None)
+
+    def store(self, key, result):
+        self.set(key, dumps(result))
+
+    def fetch(self, indexes, request, compute):
+        """
+        Returns the cached response for request, calling compute for it (and
+        caching the result) if there isn't one.
+        """
+        key, result = self.lookup(indexes, request)
+        if result is None:
+            result = compute()
+            self.store(key, result)
+        return result
+
+    def get_stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / total if total else 0.0,
+        }
+
+
+class DjangoResultCache(ResultCache):
+    """
+    Caches responses in one of the caches in the CACHES setting for timeout
+    seconds.  The generations are stored there too, so with a shared cache
+    (like memcached) a write made by one process invalidates the responses
+    cached by all of them.
+    """
+    def __init__(self, alias='default', timeout=60, key_prefix='elastic_models.results'):
+        super(DjangoResultCache, self).__init__()
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def make_key(self, key):
+        return "%s:%s" % (self.key_prefix, key)
+
+    def get_generation_key(self, index):
+        # Hashed, since memcached doesn't allow spaces or long keys.
+        return self.make_key(hashlib.md5(index.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        return self.cache.get(self.make_key(key))
+
+    def set(self, key, value):
+        self.cache.set(self.make_key(key), value, self.timeout)
+
+    def get_generation(self, index):
+        # A new generation is chosen if the cache evicted it, so older
+        # responses are never used again.
+        key = self.get_generation_key(index)
+        generation = self.cache.get(key)
+        if generation is None:
+            self.cache.add(key, uuid.uuid4().hex, None)
+            generation = self.cache.get(key)
+        return generation
+
+    def bump(self, index):
+        self.cache.set(self.get_generation_key(index), uuid.uuid4().hex, None)
+
+
+class LocalResultCache(ResultCache):
+    """
+    Caches at most max_entries responses in memory for timeout seconds,
+    evicting the least recently used first.  Generations are only bumped by
+    writes made in this process.
+    """
+    def __init__(self, max_entries=1000, timeout=60):
+        super(LocalResultCache, self).__init__()
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.generations = {}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.time():
+                return None
+            self.entries[key] = entry
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.timeout, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_generation(self, index):
+        return self.generations.get(index, 0)
+
+    def bump(self, index):
+        with self.lock:
+            self.generations[index] = self.generations.get(index, 0) + 1
+
+
+class CachedSearch(IndexSearch):
+    """
+    A Search whose responses (and counts) are cached by the configured
+    ResultCache.  Returned by Index.get_search for indexes whose
+    cache_results Meta option is True.  Pass ignore_cache=True to execute to
+    bypass the cache.
+    """
+    def get_request(self, **kwargs):
+        request = {'doc_type': self._doc_type, 'params': self._params}
+        request.update(kwargs)
+        return request
+
+    def execute(self, response_class=Response, ignore_cache=False):
+        cache = get_result_cache()
+        if cache is None or ignore_cache or hasattr(self, '_response'):
+            return super(CachedSearch, self).execute(response_class, ignore_cache)
+
+        es = connections.get_connection(self._using)
+        body = self.to_dict()
+        data = cache.fetch(self._index, self.get_request(body=body), lambda: es.search(
+            index=self._index,
+            doc_type=self._doc_type,
+            body=body,
+            **self._params
+        ))
+        self._response = response_class(data, callbacks=self._doc_type_map)
+        return self._response
+
+    def count(self):
+        cache = get_result_cache()
+        if cache is None or hasattr(self, '_response'):
+            return super(CachedSearch, self).count()
+
+        es = connections.get_connection(self._using)
+        body = self.to_dict(count=True)
+        return cache.fetch(self._index, self.get_request(count=body), lambda: es.count(
+            index=self._index,
+            doc_type=self._doc_type,
+            body=body
+        )['count'])
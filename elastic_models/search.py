@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+
+import elasticsearch_dsl as dsl
+from elasticsearch_dsl.result import Response
+
+
+class IndexSearch(dsl.Search):
+    """
+    The Search returned by Index.get_search.  It remembers the name of the
+    index's connection in ELASTICSEARCH_CONNECTIONS, so it can also be
+    executed asynchronously (see elastic_models.aio).
+    """
+    def __init__(self, connection='default', **kwargs):
+        super(IndexSearch, self).__init__(**kwargs)
+        self._connection = connection
+
+    def _clone(self):
+        s = super(IndexSearch, self)._clone()
+        s._connection = self._connection
+        return s
+
+    def aexecute(self, response_class=Response):
+        """
+        Returns a coroutine that executes the search without blocking the
+        event loop.  Requires Python 3.5 and aiohttp.
+        """
+        from .aio import aexecute
+        return aexecute(self, response_class)
+
+    def acount(self):
+        from .aio import acount
+        return acount(self)
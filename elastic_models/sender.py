@@ -0,0 +1,187 @@
+from __future__ import absolute_import
+
+import io
+import json
+import logging
+import os
+import time
+
+from django.conf import settings
+
+from elasticsearch import TransportError
+from elasticsearch.helpers import BulkIndexError, expand_action
+
+from .fingerprints import record_fingerprints
+from .resultcache import invalidate_results
+
+logger = logging.getLogger(__name__)
+
+# Responses for items (or whole requests) that may succeed if retried later.
+RETRY_STATUSES = (429, 503)
+
+
+def get_dead_letter_path():
+    return getattr(settings, 'ELASTICSEARCH_DEAD_LETTER_FILE', None)
+
+
+class BulkSender(object):
+    """
+    Sends bulk actions (in the format used by elasticsearch.helpers.bulk) in
+    batches capped by both document count and payload size.
+
+    The batch size adapts to the cluster: it is halved whenever a request
+    takes longer than target_latency seconds or is rejected, and grows back
+    towards max_docs while requests are fast.  Items the cluster rejects
+    because it is busy are retried with exponential backoff, up to
+    max_retries times.
+
+    Items that still fail are written to the dead letter file, a JSON lines
+    file that the replay_dead_letters command can send again.  Without a dead
+    letter file, a BulkIndexError is raised for them, as with
+    elasticsearch.helpers.bulk.
+
+    Partial updates of documents that don't exist aren't errors; their
+    actions are collected in missing, so the caller can index the documents
+    in full instead.  Neither are deletes of documents that don't exist.
+    """
+    def __init__(self, client, max_docs=1000, max_bytes=10 * 1024 * 1024,
+                 target_latency=2.0, max_retries=5, backoff=0.5,
+                 dead_letter_path=None):
+        self.client = client
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dead_letter_path = dead_letter_path or get_dead_letter_path()
+
+        self.batch_size = max_docs
+        self.requests = 0
+        self.retries = 0
+        self.missing = []
+        # The indexes written to, whose cached search results are discarded.
+        self.indexes = set()
+
+    def serialize(self, actions):
+        serializer = self.client.transport.serializer
+        for data in actions:
+            action, source = expand_action(data)
+            self.indexes.update(meta['_index'] for meta in action.values())
+            lines = [serializer.dumps(action)]
+            if source is not None:
+                lines.append(serializer.dumps(source))
+            size = sum(len(line) + 1 for line in lines)
+            yield data, lines, size
+
+    def batches(self, items):
+        batch = []
+        size = 0
+        for item in items:
+            if batch and (len(batch) >= self.batch_size or
+                          size + item[2] > self.max_bytes):
+                yield batch
+                batch = []
+                size = 0
+            batch.append(item)
+            size += item[2]
+        if batch:
+            yield batch
+
+    def send(self, actions):
+        """
+        Sends actions, returning the number of successful items and a list of
+        the errors for the ones that failed.
+        """
+        success = 0
+        errors = []
+        try:
+            for batch in self.batches(self.serialize(actions)):
+                batch_success, batch_errors = self.send_batch(batch)
+                success += batch_success
+                errors.extend(batch_errors)
+        finally:
+            invalidate_results(self.indexes)
+
+        if errors:
+            if self.dead_letter_path:
+                self.write_dead_letters(errors)
+            else:
+                raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+        return success, errors
+
+    def send_batch(self, batch):
+        success = 0
+        errors = []
+        attempt = 0
+        while batch:
+            body = "\n".join(line for item in batch for line in item[1]) + "\n"
+            start = time.time()
+            try:
+                response = self.client.bulk(body)
+            except TransportError as e:
+                if e.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    raise
+                retry = batch
+            else:
+                retry = []
+                sent = []
+                for item, (op_type, result) in zip(batch, (i.popitem() for i in response['items'])):
+                    status = result.get('status', 500)
+                    if 200 <= status < 300:
+                        success += 1
+                        sent.append(item[0])
+                    elif status in RETRY_STATUSES and attempt < self.max_retries:
+                        retry.append(item)
+                    elif status == 404 and op_type == 'update':
+                        self.missing.append(item[0])
+                    elif status == 404 and op_type == 'delete':
+                        # Already gone.
+                        success += 1
+                    else:
+                        result['data'] = item[0]
+                        errors.append({op_type: result})
+                record_fingerprints(sent)
+            self.requests += 1
+            self.adapt(time.time() - start, bool(retry))
+
+            batch = retry
+            if batch:
+                self.retries += 1
+                delay = self.backoff * (2 ** attempt)
+                logger.debug("Retrying %d rejected actions in %.1fs" % (len(batch), delay))
+                time.sleep(delay)
+                attempt += 1
+
+        return success, errors
+
+    def adapt(self, latency, rejected):
+        if rejected or latency > self.target_latency:
+            self.batch_size = max(1, self.batch_size // 2)
+        elif latency < self.target_latency / 2:
+            self.batch_size = min(self.max_docs, self.batch_size + max(1, self.max_docs // 10))
+
+    def write_dead_letters(self, errors):
+        logger.warning("Writing %d failed actions to %s" % (len(errors), self.dead_letter_path))
+        directory = os.path.dirname(self.dead_letter_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        serializer = self.client.transport.serializer
+        with io.open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            for error in errors:
+                (op_type, result), = error.items()
+                f.write(u"%s\n" % serializer.dumps({
+                    'action': result['data'],
+                    'error': result.get('error'),
+                    'status': result.get('status'),
+                }))
+
+
+def read_dead_letters(path):
+    """
+    Yields the actions recorded in a dead letter file.
+    """
+    with io.open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)['action']
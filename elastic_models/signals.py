@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+# Sent, with the model as sender, when the index updates for the instances
+# with the given primary keys (pks) are about to be sent, after their rows
+# changed.  The hydration caches are invalidated from it.
+instances_changed = Signal()
@@ -1,12 +1,29 @@
 from itertools import chain
 
 from django.core.paginator import Paginator, Page
+from django.db import connections
 
 
 class SearchPaginator(Paginator):
     def _get_page(self, *args, **kwargs):
         return SearchPage(*args, **kwargs)
 
+class CountedPaginator(SearchPaginator):
+    """
+    A SearchPaginator for a search that was counted in advance, e.g. along
+    with other searches (see SearchListView).  Without a count, the search
+    is counted when needed.
+    """
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self._counted = count
+
+    @property
+    def count(self):
+        if self._counted is None:
+            self._counted = self.object_list.count()
+        return self._counted
+
 class SearchPage(Page):
     def __len__(self):
         return self.object_list._extra['size']
@@ -48,3 +65,23 @@ def merge(items, overwrite=False, path=()):
             return items[-1]
         raise ValueError("Collision while merging.  Path: %s, values: %s"
                          % (path, items))
+
+def chunked(iterable, size):
+    """
+    Yields lists of at most ``size`` items from ``iterable``.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def close_db_connections():
+    """
+    Closes the current thread's database connections.
+    """
+    for connection in connections.all():
+        connection.close()
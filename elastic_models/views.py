@@ -1,17 +1,26 @@
 from django.core.paginator import InvalidPage
+from django.http import Http404
+from django.utils.translation import gettext as _
 from django.views.generic import TemplateView
 
-from .utils import SearchPaginator
+from .hydration import Hydrator
+from .multisearch import MultiSearch
+from .utils import CountedPaginator
 
 
 class SearchListView(TemplateView):
     model = None
     paginate_by = None
     paginate_orphans = 0
-    paginator_class = SearchPaginator
+    paginator_class = CountedPaginator
     page_kwarg = 'page'
     load_models = False
     search_limit = 1000
+    hydrator_class = Hydrator
+    # Maps models to the querysets their instances are loaded from.
+    hydration_querysets = None
+    # The alias of a cache in CACHES to read instances through.
+    hydration_cache = None
     
     
     def get(self, request, *args, **kwargs):
@@ -49,6 +58,14 @@ class SearchListView(TemplateView):
                                 'message': str(e)
             })
     
+    def get_facet_searches(self):
+        """
+        Returns a dictionary of searches to execute along with the page's
+        search, in the same request.  Their responses are in the context's
+        facets dictionary, under the same keys.
+        """
+        return {}
+
     def get_paginate_by(self, search):
         """
         Get the number of items to paginate by, or ``None`` for no pagination.
@@ -59,8 +76,36 @@ class SearchListView(TemplateView):
         """
         Return an instance of the paginator for this view.
         """
+        kwargs.setdefault('count', getattr(self, 'count', None))
         return self.paginator_class(search, per_page, orphans=orphans, **kwargs)
 
+    def get_page_search(self, search, page_size):
+        """
+        Returns the search for the requested page, assuming it exists, so it
+        can be executed before the search is counted.  Returns None if the
+        page can't be known in advance.
+        """
+        page = self.kwargs.get(self.page_kwarg) or self.request.GET.get(self.page_kwarg) or 1
+        try:
+            page_number = int(page)
+        except ValueError:
+            return None
+        if page_number < 1:
+            return None
+        bottom = (page_number - 1) * page_size
+        return search[bottom:bottom + page_size]
+
+    def covers_search(self, page_search, search):
+        """
+        Returns True if page_search, executed before the count was known,
+        returns the same hits as search.  It fetches as many hits as fit on
+        a page, so it doesn't cover a last page extended by orphans, which
+        takes another request.
+        """
+        page_dict, search_dict = page_search.to_dict(), search.to_dict()
+        return page_dict.pop('size', 10) >= search_dict.pop('size', 10) and \
+            page_dict == search_dict
+
     def get_paginate_orphans(self):
         """
         Returns the maximum number of orphans extend the last page by when
@@ -75,20 +120,39 @@ class SearchListView(TemplateView):
         """
         return self.allow_empty
     
-    def get_model_list(self):
-        search = self.get_search()
-        
-        pks = [h.pk for h in search.execute().hits]
-        obj_dict = self.model.objects.in_bulk(pks)
-        return [obj_dict[pk] for pk in pks]
+    def get_hydrator(self):
+        return self.hydrator_class(querysets=self.hydration_querysets,
+                                   cache=self.hydration_cache)
+
+    def get_model_list(self, result=None):
+        """
+        Returns the instances for the hits of result (by default, of the
+        whole search), leaving out any that no longer exist.
+        """
+        if result is None:
+            result = self.get_search().execute()
+        return self.get_hydrator().hydrate(result.hits)
     
     def get_context_data(self, **kwargs):
         """
         Get the context for this view.
         """
         page_size = self.get_paginate_by(self.search)
+        page_search = self.get_page_search(self.search, page_size) if page_size else self.search
+
+        # The count, the page and the facets take a single request.
+        with MultiSearch() as multi_search:
+            count_search = multi_search.add(self.search.extra(size=0)) if page_size else None
+            if page_search is not None:
+                multi_search.add(page_search)
+            facets = dict((name, multi_search.add(facet_search))
+                          for name, facet_search in self.get_facet_searches().items())
+
+        if count_search is not None:
+            self.count = count_search.execute().hits.total
         paginator, page, search, is_paginated = self.paginate_search(self.search, page_size)
-        
+        if page_search is not None and self.covers_search(page_search, search):
+            search = page_search
         result = search.execute()
         
         context = {
@@ -97,12 +161,11 @@ class SearchListView(TemplateView):
             'is_paginated': is_paginated,
             'search_result': result,
             'hits': result.hits,
+            'facets': dict((name, s.execute()) for name, s in facets.items()),
         }
         
         if self.load_models:
-            pks = [h.pk for h in result.hits]
-            obj_dict = self.model.objects.in_bulk(pks)
-            context['object_list'] = [obj_dict[pk] for pk in pks]
+            context['object_list'] = self.get_model_list(result)
         
         context.update(kwargs)
         return super(SearchListView, self).get_context_data(**context)
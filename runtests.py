@@ -19,6 +19,12 @@ settings.configure(
         'elastic_models',
     ),
     MIDDLEWARE_CLASSES=[],
+    # The test models aren't in the app's migrations, so its tables are
+    # created from the models.  (Before Django 1.9, by naming a missing
+    # module.)
+    MIGRATION_MODULES={
+        'elastic_models': None if django.VERSION[:2] >= (1, 9) else 'elastic_models.no_migrations',
+    },
     ELASTICSEARCH_CONNECTIONS={
         'default': {
             'HOSTS': ['http://localhost:9200'],
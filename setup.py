@@ -10,5 +10,6 @@ setup(
     author='Andrew Stoneman',
     extras_require={
         'test': ["django" + ("<1.7" if sys.version_info[:2] < (2, 7) else "")],
+        'async': ["aiohttp>=3.3"],
     }
 )